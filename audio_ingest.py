@@ -0,0 +1,92 @@
+import os
+
+# Uploaded speech is decoded, trimmed and re-encoded entirely through ffmpeg pipes,
+# so nothing touches the filesystem. Whisper works at 16 kHz mono anyway, and opus
+# at 24 kbit/s keeps the upload to the STT provider small.
+TARGET_SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+SILENCE_THRESHOLD_DBFS = float(os.getenv("INGEST_SILENCE_THRESHOLD_DBFS", "-45"))
+# Padding kept around speech so word onsets and endings are not clipped.
+KEEP_SILENCE_MS = int(os.getenv("INGEST_KEEP_SILENCE_MS", "150"))
+OUTPUT_BITRATE = os.getenv("INGEST_OUTPUT_BITRATE", "24k")
+
+
+class IngestResult:
+    __slots__ = ("filename", "data", "original_bytes", "original_seconds", "trimmed_seconds")
+
+    def __init__(self, filename, data, original_bytes, original_seconds=None, trimmed_seconds=None):
+        self.filename = filename
+        self.data = data
+        self.original_bytes = original_bytes
+        self.original_seconds = original_seconds
+        self.trimmed_seconds = trimmed_seconds
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - len(self.data)
+
+    @property
+    def seconds_saved(self):
+        if self.original_seconds is None:
+            return 0.0
+        return self.original_seconds - self.trimmed_seconds
+
+    def as_file(self):
+        # (filename, bytes) tuple accepted by the OpenAI client as an upload.
+        return (self.filename, self.data)
+
+
+# ffmpeg-python and pydub are imported on first use, off the app's startup path.
+
+def decode_pcm(contents):
+    import ffmpeg
+    from pydub import AudioSegment
+    pcm, _ = (
+        ffmpeg.input("pipe:0")
+        .output("pipe:1", format="s16le", acodec="pcm_s16le", ac=1, ar=TARGET_SAMPLE_RATE)
+        .run(input=contents, capture_stdout=True, capture_stderr=True)
+    )
+    return AudioSegment(pcm, sample_width=SAMPLE_WIDTH, frame_rate=TARGET_SAMPLE_RATE, channels=1)
+
+
+def encode_opus(segment):
+    import ffmpeg
+    encoded, _ = (
+        ffmpeg.input("pipe:0", format="s16le", ac=1, ar=TARGET_SAMPLE_RATE)
+        .output("pipe:1", format="ogg", acodec="libopus", audio_bitrate=OUTPUT_BITRATE)
+        .run(input=segment.raw_data, capture_stdout=True, capture_stderr=True)
+    )
+    return encoded
+
+
+def trim_silence(segment):
+    from pydub.silence import detect_leading_silence
+    lead = detect_leading_silence(segment, silence_threshold=SILENCE_THRESHOLD_DBFS, chunk_size=10)
+    if lead >= len(segment):
+        return segment[:0]
+    tail = detect_leading_silence(segment.reverse(), silence_threshold=SILENCE_THRESHOLD_DBFS, chunk_size=10)
+    start = max(0, lead - KEEP_SILENCE_MS)
+    end = min(len(segment), len(segment) - tail + KEEP_SILENCE_MS)
+    return segment[start:end]
+
+
+def ingest_audio(contents, filename="recording.webm"):
+    # Blocking (runs ffmpeg); call it off the event loop. Falls back to the original
+    # upload if anything goes wrong, so STT still gets a chance at it.
+    try:
+        segment = decode_pcm(contents)
+        trimmed = trim_silence(segment)
+        if len(trimmed) == 0:
+            trimmed = segment
+        data = encode_opus(trimmed)
+    except Exception as e:
+        stderr = getattr(e, "stderr", None)
+        print("⚠️ Audio ingest fallback:", e, stderr.decode(errors="ignore")[-200:] if stderr else "")
+        return IngestResult(filename, contents, len(contents))
+
+    result = IngestResult("speech.ogg", data, len(contents), len(segment) / 1000, len(trimmed) / 1000)
+    if result.bytes_saved < 0:
+        # Re-encoding made it bigger, so the original goes out untrimmed: nothing was saved.
+        result.filename, result.data = filename, contents
+        result.trimmed_seconds = result.original_seconds
+    return result
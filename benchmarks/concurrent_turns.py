@@ -0,0 +1,68 @@
+# Shows that concurrent /voice-stream turns overlap instead of queueing on the event loop,
+# and exits non-zero when N concurrent turns take more than --max-ratio times one turn.
+#
+#   python -m benchmarks.concurrent_turns --callers 20
+import os
+import sys
+import time
+import asyncio
+import argparse
+import httpx
+from benchmarks.fake_providers import create_app, serve_in_thread
+
+
+async def one_turn(client, caller):
+    headers = {"X-Session-Id": caller}
+    files = {"audio": ("recording.webm", b"\x1aE\xdf\xa3" + b"\x00" * 1024, "audio/webm")}
+    response = await client.post("/voice-stream", files=files, headers=headers)
+    response.raise_for_status()
+
+
+async def timed_turns(app, callers, run):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one_turn(client, f"{run}-caller{i}") for i in range(callers)))
+        return time.perf_counter() - started
+
+
+async def compare(app, callers):
+    # The first turn pays for client construction and connection set-up, so it is not timed.
+    await timed_turns(app, 1, "warmup")
+    single = await timed_turns(app, 1, "single")
+    many = await timed_turns(app, callers, "many")
+    return single, many
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--callers", type=int, default=20)
+    parser.add_argument("--max-ratio", type=float, default=2.0, help="allowed concurrent / single turn time")
+    args = parser.parse_args()
+
+    base_url, server = serve_in_thread(create_app())
+    os.environ["OPENAI_API_KEY"] = "test"
+    os.environ["ELEVENLABS_API_KEY"] = "test"
+    os.environ["OPENAI_BASE_URL"] = base_url + "/v1"
+    os.environ["ELEVENLABS_BASE_URL"] = base_url
+    # Session ids repeat between runs, so do not resume sessions journaled by a previous run.
+    os.environ.setdefault("SESSION_JOURNAL_PATH", "")
+
+    from main import app
+
+    try:
+        single, many = asyncio.run(compare(app, args.callers))
+    finally:
+        server.should_exit = True
+    ratio = many / single
+    print(f"1 turn:            {single:.2f}s")
+    print(f"{args.callers} concurrent turns: {many:.2f}s ({ratio:.1f}x one turn)")
+    if ratio > args.max_ratio:
+        print(f"❌ {args.callers} concurrent turns took {ratio:.1f}x one turn, above {args.max_ratio:.1f}x")
+        return 1
+    print("✅ within gates")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# Accuracy and latency of the rule-based field extractors over sample utterances.
+#
+#   python -m benchmarks.extractors
+#
+# Exits non-zero when a skipped LLM call got a field wrong or a foreign answer was filed locally.
+import sys
+import time
+from field_extractors import fast_extract
+
+# (assistant question, user reply, expected fields; None means the LLM must be used)
+CORPUS = [
+    ("What's your business email?", "it's john at example dot com", {"SiteEmail": "john@example.com"}),
+    ("What's your business email?", "John.Smith@Example.com", {"SiteEmail": "john.smith@example.com"}),
+    ("What email should we use for the business?", "sales underscore team at janes burgers dot com",
+     {"SiteEmail": "sales_team@janesburgers.com"}),
+    ("And the corporate email?", "office at jb llc dot com", {"CorporateEmail": "office@jbllc.com"}),
+    ("What's your customer service email?", "help at jb dot com", {"CustomerSvcEmail": "help@jb.com"}),
+    ("What's the customer service email and phone number?", "help@jb.com, 217 555 0100",
+     {"CustomerSvcEmail": "help@jb.com", "SiteVoice": "217-555-0100"}),
+    ("And the zip code?", "six two seven oh one", {"SiteZip": "62701"}),
+    ("And the zip code?", "62701", {"SiteZip": "62701"}),
+    ("What's the billing zip?", "it's 60601-1234", {"CorporateZip": "60601-1234"}),
+    ("What's the postal code for the corporate office?", "nine oh two one oh", {"CorporateZip": "90210"}),
+    ("What's the business phone number?", "two one seven five five five zero one double zero",
+     {"SiteVoice": "217-555-0100"}),
+    ("What's the business phone number?", "(217) 555-0100", {"SiteVoice": "217-555-0100"}),
+    ("What's the best phone number?", "call us at 1-312-555-0199", {"SiteVoice": "312-555-0199"}),
+    ("Do you have a fax number?", "fax is 217.555.0101", {"SiteFax": "217-555-0101"}),
+    ("What's the corporate fax?", "three one two five five five zero one nine eight", {"CorporateFax": "312-555-0198"}),
+    ("What's the best contact phone number for you?", "312 555 0199", {"CorporateVoice": "312-555-0199"}),
+    ("And a contact email?", "jane at jb dot com", {"CorporateEmail": "jane@jb.com"}),
+    ("Is there a contact fax?", "312-555-0198", {"CorporateFax": "312-555-0198"}),
+    ("Do you have a website?", "www.janesburgers.com", {"BusinessWebsite": "www.janesburgers.com"}),
+    ("What's the website?", "janesburgers.com", {"BusinessWebsite": "janesburgers.com"}),
+    ("Which state is the business in?", "we're in Illinois", {"SiteState": "IL"}),
+    ("Which state is the business in?", "West Virginia", {"SiteState": "WV"}),
+    ("What state is the billing address in?", "new york", {"CorporateState": "NY"}),
+    ("Which state?", "TX", {"SiteState": "TX"}),
+    # Questions the rules must hand to the LLM.
+    ("Do you have a website?", "yeah it's janes burgers dot com", None),
+    ("What city and state?", "Springfield, Illinois", None),
+    ("What's your DBA name?", "Jane's Burgers", None),
+    ("What's the corporate email and customer service email?", "corp at jb dot com and help at jb dot com", None),
+    ("And the zip code?", "I'm not sure, let me check", None),
+]
+# Answers shaped like a rule-based field but meant for one the rules don't fill; nothing
+# may be extracted locally, or it would be merged into the wrong field.
+FOREIGN = [
+    ("What's the retrieval fax number?", "217 555 0102"),
+    ("Should retrieval requests go by mail or fax?", "fax, to 217-555-0102"),
+]
+
+
+def main():
+    skipped = correct = wrong_skip = 0
+    started = time.perf_counter()
+    rounds = 200
+    for _ in range(rounds):
+        for question, reply, _expected in CORPUS:
+            fast_extract(question, reply)
+    per_call_us = (time.perf_counter() - started) / (rounds * len(CORPUS)) * 1e6
+
+    for question, reply, expected in CORPUS:
+        result = fast_extract(question, reply)
+        values = {key: val["value"] for key, val in result.fields.items()}
+        if result.answered:
+            skipped += 1
+            if expected is not None and values == expected:
+                correct += 1
+            else:
+                wrong_skip += 1
+                print(f"✗ {question!r} / {reply!r}: got {values}, expected {expected}")
+        elif expected is not None:
+            print(f"· not answered locally: {question!r} / {reply!r} -> {values}")
+
+    misfiled = 0
+    for question, reply in FOREIGN:
+        result = fast_extract(question, reply)
+        if result.answered or result.fields:
+            misfiled += 1
+            print(f"✗ {question!r} / {reply!r}: filed {result.fields} locally")
+
+    answerable = sum(1 for *_, expected in CORPUS if expected is not None)
+    print(f"utterances:            {len(CORPUS)} ({answerable} answerable by rules)")
+    print(f"LLM calls skipped:     {skipped}")
+    print(f"accuracy when skipped: {correct}/{skipped}")
+    print(f"wrong skips:           {wrong_skip}")
+    print(f"misfiled answers:      {misfiled}/{len(FOREIGN)}")
+    print(f"latency:               {per_call_us:.1f} µs per utterance")
+    return 1 if wrong_skip or misfiled else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+# Local stand-ins for the OpenAI and ElevenLabs HTTP APIs, with configurable latency.
+import re
+import json
+import time
+import random
+import socket
+import asyncio
+import threading
+import base64
+import uvicorn
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from starlette.requests import ClientDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+FAKE_MP3 = b"ID3" + b"\x00" * 2048
+
+# "chat" is time to the first token; "token" the gap between streamed tokens.
+DEFAULT_LATENCY = {"stt": 0.3, "extract": 0.4, "chat": 0.5, "token": 0.02, "tts": 0.4}
+
+
+def chat_payload(content, model):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+
+def chat_chunk(delta, model):
+    choice = {"index": 0, "delta": {"content": delta} if delta else {}, "finish_reason": None if delta else "stop"}
+    return "data: " + json.dumps({
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [choice]
+    }) + "\n\n"
+
+
+def create_app(latency=None, transcript="My business is called Jane's Burgers.",
+               reply="Great, thanks! I have noted Jane's Burgers as your DBA name. "
+                     "What is the legal corporate name of the business?",
+               jitter=0.0, fill_form=False, faults=None, stt_seconds_per_kb=0.0):
+    # jitter spreads every delay uniformly over +/- that fraction of its latency.
+    # fill_form makes extraction answer the first missing field, so a conversation
+    # progresses through the whole form.
+    # reply may be a callable, to vary the text (and so defeat the TTS cache) per call;
+    # transcript may be a callable taking the raw upload. stt_seconds_per_kb adds STT
+    # time in proportion to the upload, as longer recordings take longer to transcribe.
+    # faults injects failures per stage: {"tts": {"error_rate": 0.2, "slow_rate": 0.05,
+    # "slow_factor": 10}}. It can be changed while running via app.state.faults or
+    # POST /_faults.
+    latency = {**DEFAULT_LATENCY, **(latency or {})}
+    app = FastAPI()
+    app.state.calls = {"stt": 0, "extract": 0, "chat": 0, "tts": 0}
+    app.state.faults = dict(faults or {})
+    app.state.injected = {"errors": 0, "slow": 0}
+
+    @app.exception_handler(ClientDisconnect)
+    async def client_disconnected(request, exc):
+        # A hedged duplicate that lost the race, cancelled by the client mid-request.
+        return Response(status_code=499)
+
+    def delay(stage, scale=1.0):
+        seconds = latency[stage] * scale
+        if jitter:
+            seconds *= random.uniform(1 - jitter, 1 + jitter)
+        return asyncio.sleep(seconds)
+
+    async def wait(stage):
+        # Returns an error response when a failure is injected, otherwise None.
+        app.state.calls[stage] += 1
+        fault = app.state.faults.get(stage, {})
+        scale = 1.0
+        if random.random() < fault.get("slow_rate", 0):
+            app.state.injected["slow"] += 1
+            scale = fault.get("slow_factor", 10)
+        await delay(stage, scale)
+        if random.random() < fault.get("error_rate", 0):
+            app.state.injected["errors"] += 1
+            return JSONResponse({"error": {"message": f"injected {stage} failure"}}, status_code=503)
+        return None
+
+    @app.post("/_faults")
+    async def set_faults(request: Request):
+        app.state.faults = await request.json()
+        return JSONResponse(app.state.faults)
+
+    def extracted_fields(prompt):
+        # Extraction prompts list the missing fields; merged-mode instructions list every
+        # field, so there the first field stands in for the first missing one.
+        match = re.search(r"(?:Fields:|exact field names:)\s*\[([^\]]*)\]", prompt)
+        missing = re.findall(r"'([^']+)'", match.group(1)) if match else []
+        if not fill_form or not missing:
+            return {}
+        return {missing[0]: {"value": "Jane's Burgers", "confidence": 0.95}}
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions(request: Request):
+        body = await request.body()
+        failure = await wait("stt")
+        if failure:
+            return failure
+        await asyncio.sleep(len(body) / 1024 * stt_seconds_per_kb)
+        return PlainTextResponse(transcript(body) if callable(transcript) else transcript)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        system = body["messages"][0]["content"]
+        if "extract structured form fields" in system:
+            failure = await wait("extract")
+            if failure:
+                return failure
+            fields = extracted_fields(body["messages"][-1]["content"])
+            return JSONResponse(chat_payload(json.dumps(fields), body["model"]))
+        failure = await wait("chat")
+        if failure:
+            return failure
+        text = reply() if callable(reply) else reply
+        if body.get("response_format", {}).get("type") == "json_object":
+            fields = extracted_fields(body["messages"][-1]["content"])
+            return JSONResponse(chat_payload(json.dumps({"fields": fields, "reply": text}), body["model"]))
+        if not body.get("stream"):
+            return JSONResponse(chat_payload(text, body["model"]))
+
+        async def tokens():
+            for word in text.split(" "):
+                yield chat_chunk(word + " ", body["model"])
+                await delay("token")
+            yield chat_chunk("", body["model"])
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(tokens(), media_type="text/event-stream")
+
+    @app.post("/v1/text-to-speech/{voice_id}")
+    async def text_to_speech(voice_id: str, request: Request):
+        await request.body()
+        failure = await wait("tts")
+        return failure or Response(FAKE_MP3, media_type="audio/mpeg")
+
+    @app.post("/v1/text-to-speech/{voice_id}/stream")
+    async def text_to_speech_stream(voice_id: str, request: Request):
+        await request.body()
+        app.state.calls["tts"] += 1
+        if random.random() < app.state.faults.get("tts", {}).get("error_rate", 0):
+            app.state.injected["errors"] += 1
+            return JSONResponse({"detail": "injected tts failure"}, status_code=503)
+
+        async def audio():
+            # First chunk after a third of the full synthesis latency.
+            await delay("tts", 1 / 3)
+            for offset in range(0, len(FAKE_MP3), 512):
+                yield FAKE_MP3[offset:offset + 512]
+                await delay("tts", 1 / 12)
+
+        return StreamingResponse(audio(), media_type="audio/mpeg")
+
+    return app
+
+
+def create_realtime_app(transcript="My business is called Jane's Burgers.",
+                        reply="Thanks! What is the legal corporate name?",
+                        end_of_speech=0.3, first_audio=0.2, audio_chunks=8):
+    # Mimics the realtime API: server VAD on appended audio, input transcription and
+    # an automatic spoken response, with response.cancel support.
+    app = FastAPI()
+    app.state.cancelled = 0
+
+    @app.websocket("/v1/realtime")
+    async def realtime(websocket: WebSocket):
+        await websocket.accept()
+        speaking = False
+        responding = None
+        last_audio = 0.0
+
+        async def send(event):
+            await websocket.send_text(json.dumps(event))
+
+        async def respond(text):
+            await send({"type": "response.created"})
+            await asyncio.sleep(first_audio)
+            for word in text.split(" "):
+                await send({"type": "response.audio_transcript.delta", "delta": word + " "})
+            for _ in range(audio_chunks):
+                await send({"type": "response.audio.delta", "delta": base64.b64encode(b"\x00" * 960).decode()})
+                await asyncio.sleep(0.02)
+            await send({"type": "response.audio_transcript.done", "transcript": text})
+            await send({"type": "response.done"})
+
+        async def vad():
+            nonlocal speaking, responding
+            while True:
+                await asyncio.sleep(0.05)
+                if speaking and time.monotonic() - last_audio > end_of_speech:
+                    speaking = False
+                    await send({"type": "input_audio_buffer.speech_stopped"})
+                    await send({"type": "conversation.item.input_audio_transcription.completed",
+                                "transcript": transcript})
+                    responding = asyncio.create_task(respond(reply))
+
+        detector = asyncio.create_task(vad())
+        try:
+            while True:
+                event = json.loads(await websocket.receive_text())
+                kind = event.get("type")
+                if kind == "input_audio_buffer.append":
+                    last_audio = time.monotonic()
+                    if not speaking:
+                        speaking = True
+                        await send({"type": "input_audio_buffer.speech_started"})
+                elif kind == "response.cancel" and responding and not responding.done():
+                    responding.cancel()
+                    app.state.cancelled += 1
+                    await send({"type": "response.done"})
+                elif kind == "response.create":
+                    instructions = event.get("response", {}).get("instructions", reply)
+                    responding = asyncio.create_task(respond(instructions.split(": ", 1)[-1]))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            detector.cancel()
+            if responding:
+                responding.cancel()
+
+    return app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app):
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}", server
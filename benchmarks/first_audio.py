@@ -0,0 +1,58 @@
+# Time to first audio byte: buffered /voice-stream vs. sentence-pipelined /voice-stream/events.
+#
+#   python -m benchmarks.first_audio
+import os
+import time
+import asyncio
+import httpx
+from benchmarks.fake_providers import create_app, serve_in_thread
+
+AUDIO_UPLOAD = {"audio": ("recording.webm", b"\x1aE\xdf\xa3" + b"\x00" * 1024, "audio/webm")}
+
+
+async def buffered(client):
+    started = time.perf_counter()
+    response = await client.post("/voice-stream", files=AUDIO_UPLOAD, headers={"X-Session-Id": "buffered"})
+    response.raise_for_status()
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed
+
+
+async def streamed(client):
+    started = time.perf_counter()
+    first_audio = None
+    async with client.stream("POST", "/voice-stream/events", files=AUDIO_UPLOAD,
+                             headers={"X-Session-Id": "streamed"}) as response:
+        async for line in response.aiter_lines():
+            if first_audio is None and line == "event: audio":
+                first_audio = time.perf_counter() - started
+    return first_audio, time.perf_counter() - started
+
+
+async def run(app_url):
+    # A real server rather than ASGITransport, which buffers streamed bodies.
+    async with httpx.AsyncClient(base_url=app_url, timeout=120) as client:
+        return await buffered(client), await streamed(client)
+
+
+def main():
+    base_url, server = serve_in_thread(create_app())
+    os.environ["OPENAI_API_KEY"] = "test"
+    os.environ["ELEVENLABS_API_KEY"] = "test"
+    os.environ["OPENAI_BASE_URL"] = base_url + "/v1"
+    os.environ["ELEVENLABS_BASE_URL"] = base_url
+    # Session ids repeat between runs, so do not resume sessions journaled by a previous run.
+    os.environ.setdefault("SESSION_JOURNAL_PATH", "")
+
+    from main import app
+
+    app_url, app_server = serve_in_thread(app)
+    (buffered_first, buffered_total), (streamed_first, streamed_total) = asyncio.run(run(app_url))
+    print(f"buffered  first audio {buffered_first:.2f}s  total {buffered_total:.2f}s")
+    print(f"streamed  first audio {streamed_first:.2f}s  total {streamed_total:.2f}s")
+    app_server.should_exit = True
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
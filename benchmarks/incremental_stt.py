@@ -0,0 +1,226 @@
+# End of speech to transcript: one upload after the user stops talking vs. incremental
+# segments uploaded and transcribed while they are still talking. Both replay the same
+# speech timeline (segments separated by short pauses, then the end-of-speech silence),
+# against an STT stand-in whose latency grows with the size of the upload.
+# Then checks /voice-stream/chunks against the same stand-in: transcripts, out-of-order
+# chunks, the 409 fallback, size limits and the per-worker buffer budget, and exits
+# non-zero when a check fails.
+#
+#   python -m benchmarks.incremental_stt --segments 3 --segment-seconds 2
+import os
+import re
+import sys
+import json
+import time
+import socket
+import subprocess
+import uuid
+import asyncio
+import argparse
+import statistics
+import httpx
+from benchmarks.fake_providers import create_app, serve_in_thread
+
+# Mirrors templates/index.html: a pause this long closes a segment, and this much
+# silence ends the utterance.
+SEGMENT_PAUSE = 0.3
+SILENCE_DELAY = 0.8
+
+
+def echo_words(body):
+    # The stand-in "transcribes" the word markers embedded in each chunk.
+    return " ".join(word.decode() for word in re.findall(rb"WORD(\w+);", body))
+
+
+def chunk_bytes(segment, seq, seconds, kb_per_second):
+    return f"WORDs{segment}c{seq};".encode() + b"\0" * int(seconds * kb_per_second * 1024)
+
+
+async def user_text_after(client, ended, url, session, **kwargs):
+    # Seconds from the end of speech until the transcript event arrives, and the transcript.
+    async with client.stream("POST", url, headers={"X-Session-Id": session}, **kwargs) as response:
+        response.raise_for_status()
+        event = result = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: ") and event == "user_text" and result is None:
+                result = time.perf_counter() - ended, json.loads(line[6:])["text"]
+    if result is None:
+        raise RuntimeError("no user_text event")
+    return result
+
+
+async def speak(args, on_chunk):
+    # Replays the speech timeline, handing each timeslice to on_chunk as it is recorded.
+    chunks = max(1, round(args.segment_seconds / args.chunk_seconds))
+    for segment in range(args.segments):
+        for seq in range(chunks):
+            await asyncio.sleep(args.chunk_seconds)
+            on_chunk(segment, seq, chunk_bytes(segment, seq, args.chunk_seconds, args.kb_per_second), False)
+        await asyncio.sleep(SEGMENT_PAUSE)
+        # Stopping the segment's recorder flushes one last (here empty) chunk.
+        on_chunk(segment, chunks, b"", True)
+    await asyncio.sleep(SILENCE_DELAY - SEGMENT_PAUSE)
+    return time.perf_counter()
+
+
+async def buffered_turn(client, args):
+    recorded = []
+    ended = await speak(args, lambda segment, seq, data, last: recorded.append(data))
+    files = {"audio": ("recording.webm", b"".join(recorded), "audio/webm")}
+    return await user_text_after(client, ended, "/voice-stream/events", uuid.uuid4().hex, files=files)
+
+
+async def incremental_turn(client, args):
+    session, utterance = uuid.uuid4().hex, uuid.uuid4().hex
+    uploads = []
+
+    def upload(segment, seq, data, last):
+        params = {"utterance": utterance, "segment": segment, "seq": seq, "last": int(last)}
+        uploads.append(asyncio.ensure_future(client.post(
+            "/voice-stream/chunks", params=params, content=data, headers={"X-Session-Id": session})))
+
+    ended = await speak(args, upload)
+    for response in await asyncio.gather(*uploads):
+        response.raise_for_status()
+    params = {"utterance": utterance, "segments": args.segments}
+    return await user_text_after(client, ended, "/voice-stream/events", session, params=params)
+
+
+def expected_transcript(args):
+    chunks = max(1, round(args.segment_seconds / args.chunk_seconds))
+    return " ".join(f"s{segment}c{seq}" for segment in range(args.segments) for seq in range(chunks))
+
+
+def declared_size_refused(app_url, size):
+    # Sends only the headers of an oversized chunk: the answer must come without the body.
+    host, port = app_url.split("//")[1].split(":")
+    with socket.create_connection((host, int(port)), timeout=5) as sock:
+        sock.sendall((f"POST /voice-stream/chunks?utterance=big&segment=0&seq=0 HTTP/1.1\r\n"
+                      f"Host: {host}\r\nContent-Length: {size}\r\n\r\n").encode())
+        try:
+            status_line = sock.recv(1024).split(b"\r\n", 1)[0]
+        except socket.timeout:
+            return False
+        return status_line.split(b" ")[1:2] == [b"413"]
+
+
+async def check(app_url, args, results):
+    import main
+    from transcription import utterances
+
+    expected = expected_transcript(args)
+    checks = {
+        "buffered transcript": all(text == expected for _, text in results["buffered"]),
+        "incremental transcript": all(text == expected for _, text in results["incremental"]),
+    }
+    async with httpx.AsyncClient(base_url=app_url, timeout=60) as client:
+        session = uuid.uuid4().hex
+        headers = {"X-Session-Id": session}
+
+        async def chunk(utterance, segment, seq, data, last=False):
+            params = {"utterance": utterance, "segment": segment, "seq": seq, "last": int(last)}
+            response = await client.post("/voice-stream/chunks", params=params, content=data, headers=headers)
+            return response.status_code
+
+        async def finish(utterance, segments):
+            return await client.post("/voice-stream", params={"utterance": utterance, "segments": segments},
+                                     headers=headers)
+
+        # Chunks arriving last-first still make up the segment in order.
+        utterance = uuid.uuid4().hex
+        for seq in (2, 1, 0):
+            await chunk(utterance, 0, seq, chunk_bytes(0, seq, 0, 0), last=seq == 2)
+        response = await finish(utterance, 1)
+        checks["out-of-order chunks"] = response.json().get("user_text") == "s0c0 s0c1 s0c2"
+
+        # A segment this worker never saw: 409, then the client re-sends the segments.
+        utterance = uuid.uuid4().hex
+        await chunk(utterance, 0, 0, chunk_bytes(0, 0, 0, 0), last=True)
+        response = await finish(utterance, 2)
+        checks["missing segment answers 409"] = response.status_code == 409
+        files = [("audio", (f"segment{i}.webm", chunk_bytes(i, 0, 0, 0), "audio/webm")) for i in range(2)]
+        response = await client.post("/voice-stream", files=files, headers=headers)
+        checks["re-uploaded segments"] = response.json().get("user_text") == "s0c0 s1c0"
+
+        # Size limits: one utterance, then everything buffered in this worker.
+        checks["oversized chunk refused by Content-Length"] = declared_size_refused(app_url, utterances.max_bytes + 1)
+        checks["oversized utterance answers 413"] = await chunk(
+            uuid.uuid4().hex, 0, 0, b"\0" * (utterances.max_bytes + 1)) == 413
+        piece = utterances.max_bytes // 2
+        pending = [uuid.uuid4().hex for _ in range(utterances.max_buffered_bytes // piece + 1)]
+        statuses = [await chunk(utterance, 0, 0, b"\0" * piece) for utterance in pending]
+        checks["buffer budget answers 503"] = statuses[-1] == 503 and set(statuses[:-1]) == {202}
+        for utterance in pending:
+            await finish(utterance, 1)
+        checks["buffer released after turns"] = utterances.buffered_bytes == 0 and len(utterances) == 0
+
+        # Several workers: chunk uploads are switched off and the client told so.
+        main.INCREMENTAL_UPLOADS = False
+        try:
+            refused = await chunk(uuid.uuid4().hex, 0, 0, b"data") == 404
+            offered = (await client.get("/initial-message", headers=headers)).json()["incremental_upload"]
+        finally:
+            main.INCREMENTAL_UPLOADS = True
+        checks["disabled uploads answer 404"] = refused and offered is False
+    code = "import transcription; print(transcription.INCREMENTAL_UPLOADS)"
+    env = {**os.environ, "WEB_CONCURRENCY": "4"}
+    env.pop("INCREMENTAL_UPLOADS", None)
+    auto = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    checks["off by default with several workers"] = auto.stdout.strip().splitlines()[-1:] == ["False"]
+    return checks
+
+
+async def run(app_url, args):
+    results = {"buffered": [], "incremental": []}
+    async with httpx.AsyncClient(base_url=app_url, timeout=120) as client:
+        for _ in range(args.turns):
+            results["buffered"].append(await buffered_turn(client, args))
+            results["incremental"].append(await incremental_turn(client, args))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--segments", type=int, default=3)
+    parser.add_argument("--segment-seconds", type=float, default=2.0)
+    parser.add_argument("--chunk-seconds", type=float, default=1.0, help="MediaRecorder timeslice")
+    parser.add_argument("--kb-per-second", type=float, default=4.0, help="recorded audio size (opus ~32 kbit/s)")
+    parser.add_argument("--stt-seconds-per-kb", type=float, default=0.02)
+    parser.add_argument("--turns", type=int, default=3)
+    args = parser.parse_args()
+
+    base_url, server = serve_in_thread(create_app(transcript=echo_words, stt_seconds_per_kb=args.stt_seconds_per_kb))
+    os.environ["OPENAI_API_KEY"] = "test"
+    os.environ["ELEVENLABS_API_KEY"] = "test"
+    os.environ["OPENAI_BASE_URL"] = base_url + "/v1"
+    os.environ["ELEVENLABS_BASE_URL"] = base_url
+    os.environ.setdefault("SESSION_JOURNAL_PATH", "")
+    # Small limits, so the checks can reach them quickly.
+    os.environ.setdefault("MAX_UTTERANCE_BYTES", str(256 * 1024))
+    os.environ.setdefault("MAX_BUFFERED_UTTERANCE_BYTES", str(1024 * 1024))
+    os.environ["INCREMENTAL_UPLOADS"] = "1"
+
+    from main import app
+
+    app_url, app_server = serve_in_thread(app)
+    try:
+        results = asyncio.run(run(app_url, args))
+        checks = asyncio.run(check(app_url, args, results))
+    finally:
+        app_server.should_exit = True
+        server.should_exit = True
+
+    speech = args.segments * (args.segment_seconds + SEGMENT_PAUSE)
+    print(f"{args.segments} segments, {speech:.1f}s of speech per turn, {args.turns} turns")
+    for mode, turns in results.items():
+        median = statistics.median(elapsed for elapsed, _ in turns)
+        print(f"{mode:<12} end of speech -> transcript  median {median:.3f}s  transcript {turns[-1][1]}")
+    for name, passed in checks.items():
+        print(f"{'✅' if passed else '❌'} {name}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
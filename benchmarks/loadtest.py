@@ -0,0 +1,181 @@
+# Load test: many simulated callers each run a full conversation through the app
+# (/initial-message, N x /voice-stream, /upload-signature, /confirm, /download)
+# against jittered provider stand-ins. Reports throughput, per-endpoint latency
+# percentiles and event-loop blocking, and exits non-zero when a gate is exceeded.
+#
+#   python -m benchmarks.loadtest --callers 50 --turns 6 --max-p95 5 --max-loop-block-ms 100
+import io
+import os
+import sys
+import time
+import base64
+import random
+import tempfile
+import asyncio
+import argparse
+import contextlib
+from collections import defaultdict
+import httpx
+from PIL import Image
+from benchmarks.fake_providers import create_app, serve_in_thread
+
+AUDIO = ("recording.webm", b"\x1aE\xdf\xa3" + b"\x00" * 4096, "audio/webm")
+# Ticks of the loop-lag probe; a tick that wakes later than this is counted as blocked.
+LAG_INTERVAL = 0.01
+BLOCKED_THRESHOLD = 0.005
+
+
+def signature_data_url():
+    image = Image.new("RGBA", (300, 100), (255, 255, 255, 0))
+    for x in range(20, 280):
+        image.putpixel((x, 50 + (x % 20) - 10), (0, 0, 0, 255))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, endpoint, request):
+        started = time.perf_counter()
+        try:
+            response = await request
+            response.raise_for_status()
+            return response
+        except Exception:
+            self.errors[endpoint] += 1
+            return None
+        finally:
+            self.latencies[endpoint].append(time.perf_counter() - started)
+
+
+async def conversation(client, recorder, caller, turns, think_time, signature):
+    headers = {"X-Session-Id": f"loadtest{caller}"}
+    await recorder.call("/initial-message", client.get("/initial-message", headers=headers))
+    for _ in range(turns):
+        await asyncio.sleep(random.uniform(0, think_time))
+        await recorder.call("/voice-stream", client.post("/voice-stream", files={"audio": AUDIO}, headers=headers))
+    await recorder.call("/upload-signature", client.post(
+        "/upload-signature", json={"signature_image": signature}, headers=headers))
+    await recorder.call("/confirm", client.post("/confirm", json={"confirmed": True}, headers=headers))
+    await recorder.call("/download", client.get("/download", headers=headers))
+
+
+async def watch_loop(lags, stop):
+    # Measures how late each tick wakes up; lateness is time the loop spent blocked.
+    expected = time.perf_counter() + LAG_INTERVAL
+    while not stop.is_set():
+        await asyncio.sleep(LAG_INTERVAL)
+        now = time.perf_counter()
+        lags.append(max(0.0, now - expected))
+        expected = now + LAG_INTERVAL
+
+
+async def run_load(app, callers, turns, ramp, think_time):
+    recorder = Recorder()
+    lags = []
+    stop = asyncio.Event()
+    signature = signature_data_url()
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport skips the lifespan, so run it here and let the warm-up finish: the
+    # load test measures a warm process, and benchmarks.startup measures cold start.
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://app", timeout=300) as client:
+        await app.state.warm_up
+
+        async def caller(index):
+            await asyncio.sleep(ramp * index / max(1, callers))
+            await conversation(client, recorder, index, turns, think_time, signature)
+
+        watcher = asyncio.create_task(watch_loop(lags, stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(caller(i) for i in range(callers)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await watcher
+    return recorder, lags, elapsed
+
+
+def report(recorder, lags, elapsed, callers):
+    requests = sum(len(values) for values in recorder.latencies.values())
+    print(f"\n{callers} conversations, {requests} requests in {elapsed:.1f}s "
+          f"({requests / elapsed:.1f} req/s, {callers / elapsed * 60:.1f} conversations/min)")
+    print(f"{'endpoint':<18} {'count':>6} {'errors':>6} {'p50':>8} {'p95':>8} {'p99':>8}")
+    p95s = {}
+    for endpoint, values in recorder.latencies.items():
+        values = sorted(values)
+        p95s[endpoint] = percentile(values, 0.95)
+        print(f"{endpoint:<18} {len(values):>6} {recorder.errors[endpoint]:>6} "
+              f"{percentile(values, 0.5):>7.3f}s {p95s[endpoint]:>7.3f}s {percentile(values, 0.99):>7.3f}s")
+
+    sorted_lags = sorted(lags)
+    blocked = sum(lag for lag in lags if lag > BLOCKED_THRESHOLD)
+    worst = sorted_lags[-1] if sorted_lags else 0.0
+    print(f"event loop: max lag {worst * 1000:.1f} ms, p99 lag {percentile(sorted_lags, 0.99) * 1000:.1f} ms, "
+          f"blocked {blocked * 1000:.0f} ms total ({blocked / elapsed:.1%} of run)")
+    return p95s, worst, sum(recorder.errors.values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--callers", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=6, help="/voice-stream turns per conversation")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which callers start")
+    parser.add_argument("--think-time", type=float, default=0.5, help="max pause before each turn (s)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="provider latency jitter, as a fraction")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier on provider latencies")
+    parser.add_argument("--max-p95", type=float, default=None, help="fail if any endpoint p95 exceeds this (s)")
+    parser.add_argument("--max-loop-block-ms", type=float, default=None, help="fail if the worst loop lag exceeds this")
+    parser.add_argument("--max-errors", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the app's own logging")
+    args = parser.parse_args()
+
+    latency = None
+    if args.latency_scale != 1.0:
+        from benchmarks.fake_providers import DEFAULT_LATENCY
+        latency = {stage: seconds * args.latency_scale for stage, seconds in DEFAULT_LATENCY.items()}
+    base_url, server = serve_in_thread(create_app(latency, jitter=args.jitter, fill_form=True))
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    os.environ.setdefault("ELEVENLABS_API_KEY", "test")
+    os.environ["OPENAI_BASE_URL"] = base_url + "/v1"
+    os.environ["ELEVENLABS_BASE_URL"] = base_url
+    # Journal to a fresh file: the load includes session persistence, without resuming earlier runs.
+    journal_dir = tempfile.TemporaryDirectory()
+    os.environ.setdefault("SESSION_JOURNAL_PATH", os.path.join(journal_dir.name, "sessions.db"))
+
+    from main import app
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        recorder, lags, elapsed = asyncio.run(
+            run_load(app, args.callers, args.turns, args.ramp, args.think_time))
+    server.should_exit = True
+
+    p95s, worst_lag, errors = report(recorder, lags, elapsed, args.callers)
+    failures = []
+    if args.max_p95 is not None:
+        failures += [f"{endpoint} p95 {p95:.3f}s > {args.max_p95}s"
+                     for endpoint, p95 in p95s.items() if p95 > args.max_p95]
+    if args.max_loop_block_ms is not None and worst_lag * 1000 > args.max_loop_block_ms:
+        failures.append(f"event loop blocked {worst_lag * 1000:.1f} ms > {args.max_loop_block_ms} ms")
+    if errors > args.max_errors:
+        failures.append(f"{errors} failed requests > {args.max_errors}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ within gates")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
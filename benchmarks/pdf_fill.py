@@ -0,0 +1,93 @@
+# Fills per second: the original two-pass fill_pdf vs. the cached PdfTemplate engine.
+#
+#   python -m benchmarks.pdf_fill --seconds 5
+import io
+import os
+import time
+import tempfile
+import argparse
+import fitz
+from PIL import Image, ImageDraw
+from fill_pdf_logic import PdfTemplate, extract_form_fields, prepare_fill_data
+
+TEMPLATE = "form_template.pdf"
+
+SAMPLE = {
+    "SiteCompanyName1": "Jane's Burgers", "SiteAddress": "12 Main Street", "SiteCity": "Springfield",
+    "SiteState": "IL", "SiteZip": "62701", "SiteVoice": "217-555-0100", "SiteFax": "217-555-0101",
+    "CorporateCompanyName1": "Jane's Burgers LLC", "CorporateAddress": "12 Main Street",
+    "CorporateCity": "Springfield", "CorporateState": "IL", "CorporateZip": "62701",
+    "CorporateName": "Jane Doe", "SiteEmail": "jane@janesburgers.com", "CorporateVoice": "217-555-0100",
+    "CorporateFax": "217-555-0101", "BusinessWebsite": "janesburgers.com",
+    "CorporateEmail": "office@janesburgers.com", "CustomerSvcEmail": "help@janesburgers.com",
+    "MCC-Desc": "Restaurants", "MerchantInitials": "JD", "MerchantSignatureName": "Jane Doe",
+}
+
+
+def sample_signature():
+    img = Image.new("RGBA", (300, 100), (255, 255, 255, 0))
+    ImageDraw.Draw(img).line((10, 60, 120, 30, 200, 70, 290, 40), fill="black", width=3)
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def baseline_fill(pdf_path, output_pdf_path, data, signature_png):
+    # The pre-engine algorithm: walk every widget, reopen the file, re-encode the
+    # signature through PIL for each signature field.
+    data = prepare_fill_data(data)
+    fields = extract_form_fields(pdf_path)
+    doc = fitz.open(pdf_path)
+    for field_name, field_info in fields.items():
+        if data.get(field_name):
+            page = doc[field_info["page"]]
+            x0, y0, x1, y1 = field_info["rect"]
+            page.insert_text((x0 + 2, y0 + (y1 - y0) * 0.75), str(data[field_name]),
+                             fontsize=min(11, (y1 - y0) - 2), fontname="helv")
+    img = Image.open(io.BytesIO(signature_png))
+    img_width, img_height = img.size
+    for sig_field in ["signer1signature1", "signer1signature2"]:
+        if sig_field in fields:
+            field = fields[sig_field]
+            x0, y0, x1, y1 = field["rect"]
+            scale = min((x1 - x0) / img_width, (y1 - y0) / img_height)
+            img_byte_arr = io.BytesIO()
+            img.save(img_byte_arr, format="PNG")
+            doc[field["page"]].insert_image(
+                fitz.Rect(x0, y0, x0 + img_width * scale, y0 + img_height * scale),
+                stream=img_byte_arr.getvalue()
+            )
+    doc.save(output_pdf_path, incremental=False, deflate=True)
+    doc.close()
+
+
+def fills_per_second(fill, seconds):
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        fill()
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    signature = sample_signature()
+    started = time.perf_counter()
+    template = PdfTemplate(TEMPLATE)
+    print(f"template index built in {(time.perf_counter() - started) * 1000:.1f} ms "
+          f"({len(template.fields)} fields)")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        output = os.path.join(scratch, "filled.pdf")
+        before = fills_per_second(lambda: baseline_fill(TEMPLATE, output, SAMPLE, signature), args.seconds)
+        after = fills_per_second(lambda: template.render_to(output, SAMPLE, signature), args.seconds)
+    print(f"before: {before:6.1f} fills/s")
+    print(f"after:  {after:6.1f} fills/s ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
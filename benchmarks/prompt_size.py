@@ -0,0 +1,101 @@
+# Per-turn prompt tokens over a long session: the old full-history window vs. the
+# budgeted ContextBuilder. Prompt size should stay flat as the session grows.
+#
+#   python -m benchmarks.prompt_size --turns 100 --max-spread 150
+#
+# Exits non-zero when the budgeted dialogue prompt goes over its token budget or, after
+# the first turns, its size varies by more than --max-spread tokens.
+import os
+import sys
+import argparse
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from session_store import SessionState, FORM_FIELDS
+from prompt_context import prompt_tokens, count_tokens, CONTEXT_TOKEN_BUDGET
+from realtime_assistant import (
+    INSTRUCTION_PROMPT,
+    EXTRACTION_SYSTEM_PROMPT,
+    build_dialogue_messages,
+    build_extraction_prompt,
+)
+
+USER_LINES = [
+    "Sure, it's Jane's Burgers, we've been open about six years now on the corner of Main and Fifth.",
+    "The legal name is Jane's Burgers LLC, registered in Illinois a while back.",
+    "Our email is hello at janes burgers dot com and the phone is two one seven five five five zero one zero zero.",
+    "Hmm, let me think about that one for a second, I'm not totally sure what you need there.",
+]
+ASSISTANT_LINE = ("Thanks, got it! Next, could you tell me the {label}? For example, something like "
+                  "the one printed on your invoices or business cards.")
+
+
+def legacy_dialogue_tokens(state):
+    messages = [{"role": "system", "content": INSTRUCTION_PROMPT}] + [
+        {"role": msg["role"], "content": msg["text"]} for msg in state.conversation_history[-12:]
+    ]
+    return prompt_tokens(messages)
+
+
+def legacy_extraction_tokens(state, user_text):
+    prompt = (f"You are helping fill out a Merchant Processing Application. Based on the assistant's last "
+              f"question and the user's reply, extract any relevant fields from this list:\n\n"
+              f"{list(state.form_data.keys())}\n\nAssistant: {state.last_assistant_msg}\nUser: {user_text}\n\n"
+              f"Return only a JSON object using those exact field names. If unsure or likely to be wrong, "
+              f"still include it and indicate the confidence level like this:\n"
+              f"{{ \"SiteCompanyName1\": {{\"value\": \"Jane’s Burgers\", \"confidence\": 0.6 }} }}\n\n"
+              f"If nothing applies, return {{}}.")
+    return count_tokens("You extract structured form fields with confidence.") + count_tokens(prompt) + 8
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--budget", type=int, default=CONTEXT_TOKEN_BUDGET, help="max dialogue prompt tokens")
+    parser.add_argument("--max-spread", type=int, default=150, help="max - min dialogue prompt tokens after turn 10")
+    args = parser.parse_args()
+
+    state = SessionState("bench")
+    rows = []
+    for turn in range(1, args.turns + 1):
+        user_text = USER_LINES[turn % len(USER_LINES)]
+        state.append_turn("user", user_text)
+        field = FORM_FIELDS[turn % len(FORM_FIELDS)]
+        if turn % 3 == 0:
+            state.form_data[field] = f"value {turn}"
+        new_extraction = (count_tokens(EXTRACTION_SYSTEM_PROMPT) + count_tokens(build_extraction_prompt(state, user_text)) + 8)
+        rows.append((
+            turn,
+            legacy_dialogue_tokens(state),
+            prompt_tokens(build_dialogue_messages(state)),
+            legacy_extraction_tokens(state, user_text),
+            new_extraction,
+            len(state.conversation_history),
+        ))
+        state.last_assistant_msg = ASSISTANT_LINE.format(label=field)
+        state.append_turn("assistant", state.last_assistant_msg)
+
+    print("turn  dialogue(old)  dialogue(new)  extract(old)  extract(new)  history")
+    for row in rows:
+        if row[0] in (1, 5, 10, 25, 50, 75, 100) or row[0] == args.turns:
+            print("{:>4}  {:>13}  {:>13}  {:>12}  {:>12}  {:>7}".format(*row))
+    new_dialogue = [row[2] for row in rows[10:]] or [row[2] for row in rows]
+    print(f"dialogue prompt (new) after turn 10: min {min(new_dialogue)}, max {max(new_dialogue)} tokens")
+    print(f"stable system prefix: {count_tokens(INSTRUCTION_PROMPT)} tokens")
+
+    failures = []
+    largest = max(row[2] for row in rows)
+    if largest > args.budget:
+        failures.append(f"dialogue prompt {largest} tokens > budget {args.budget}")
+    spread = max(new_dialogue) - min(new_dialogue)
+    if spread > args.max_spread:
+        failures.append(f"dialogue prompt varies by {spread} tokens > {args.max_spread}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ within gates")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# End-to-end check of /ws/voice against the realtime stand-in: the browser's audio is
+# relayed upstream, the user and assistant transcripts and assistant audio come back,
+# the turn fills a form field, and talking over the assistant cancels its response.
+# Reports end of speech -> first assistant audio, and exits non-zero when a check fails.
+#
+#   python -m benchmarks.realtime_relay
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from websockets.asyncio.client import connect
+from benchmarks.fake_providers import create_app, create_realtime_app, serve_in_thread
+
+FRAME = b"\x01\x00" * 480  # 20 ms of pcm16 at 24 kHz
+TRANSCRIPT = "My business is called Jane's Burgers."
+REPLY = "Thanks! What is the legal corporate name of the business?"
+
+
+async def speak(websocket, seconds):
+    # Streams microphone frames in real time; returns when the user stops talking.
+    for _ in range(max(1, round(seconds / 0.02))):
+        await websocket.send(FRAME)
+        await asyncio.sleep(0.02)
+    return time.perf_counter()
+
+
+async def receive_until(websocket, stop, frames, timeout=10):
+    # Collects frames as (arrival time, frame) until stop(frame) is true.
+    deadline = time.perf_counter() + timeout
+    while True:
+        message = await asyncio.wait_for(websocket.recv(), deadline - time.perf_counter())
+        frame = message if isinstance(message, bytes) else json.loads(message)
+        frames.append((time.perf_counter(), frame))
+        if stop(frame):
+            return frame
+
+
+def of_type(frames, kind):
+    return [frame for _, frame in frames if isinstance(frame, dict) and frame.get("type") == kind]
+
+
+async def run(app_url, args, realtime):
+    checks = {}
+    async with connect(app_url.replace("http", "ws") + "/ws/voice", max_size=None) as websocket:
+        session = json.loads(await websocket.recv())
+        checks["session frame with an empty form"] = (
+            session["type"] == "session" and session["form_data"]["SiteCompanyName1"] is None)
+
+        # Turn 1: speak, wait for the full reply and the form update.
+        frames = []
+        ended = await speak(websocket, args.speech_seconds)
+        await receive_until(websocket, lambda f: isinstance(f, dict) and f.get("type") == "form_data", frames)
+        # The spoken reply may still be playing when the form update arrives.
+        audio = [at for at, frame in frames if isinstance(frame, bytes)]
+        while len(audio) < args.audio_chunks:
+            await receive_until(websocket, lambda f: isinstance(f, bytes), frames)
+            audio = [at for at, frame in frames if isinstance(frame, bytes)]
+        first_audio = audio[0] - ended
+        user_texts = of_type(frames, "user_text")
+        assistant_text = "".join(frame["delta"] for frame in of_type(frames, "assistant_text"))
+        update = of_type(frames, "form_data")[-1]
+        form = update["form_data"]
+        checks["user transcript relayed"] = [frame["text"] for frame in user_texts] == [TRANSCRIPT]
+        checks["assistant transcript relayed"] = assistant_text.strip() == REPLY
+        checks["all assistant audio relayed"] = len(audio) == args.audio_chunks
+        checks["turn filled the DBA name"] = form["SiteCompanyName1"] == "Jane's Burgers"
+        checks["form version bumped"] = update.get("form_version") == 1
+
+        # Turn 2: talk over the assistant once its audio starts; the upstream response
+        # is cancelled and the browser told to stop playback.
+        frames = []
+        await speak(websocket, args.speech_seconds)
+        await receive_until(websocket, lambda f: isinstance(f, bytes), frames)
+        cancelled_before = realtime.state.cancelled
+        await speak(websocket, 0.1)
+        await receive_until(websocket, lambda f: isinstance(f, dict) and f.get("type") == "interrupt", frames)
+        # Wait for the interruption's own turn to finish, then count the cut-off reply's audio.
+        await receive_until(websocket, lambda f: isinstance(f, dict) and f.get("type") == "form_data", frames)
+        await asyncio.sleep(0.3)
+        interrupted_at = next(i for i, (_, frame) in enumerate(frames)
+                              if isinstance(frame, dict) and frame.get("type") == "interrupt")
+        before_interrupt = sum(1 for _, frame in frames[:interrupted_at] if isinstance(frame, bytes))
+        checks["barge-in cancelled the upstream response"] = realtime.state.cancelled == cancelled_before + 1
+        checks["barge-in cut the reply's audio short"] = before_interrupt < args.audio_chunks
+        form = of_type(frames, "form_data")[-1]["form_data"]
+        checks["later turns keep filling the form"] = form["SiteAddress"] == "Jane's Burgers"
+    return checks, first_audio
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--speech-seconds", type=float, default=0.5)
+    parser.add_argument("--audio-chunks", type=int, default=40, help="assistant audio frames per reply")
+    args = parser.parse_args()
+
+    base_url, server = serve_in_thread(create_app({"extract": 0.1}, fill_form=True))
+    realtime = create_realtime_app(transcript=TRANSCRIPT, reply=REPLY, audio_chunks=args.audio_chunks)
+    realtime_url, realtime_server = serve_in_thread(realtime)
+    os.environ["OPENAI_API_KEY"] = "test"
+    os.environ["ELEVENLABS_API_KEY"] = "test"
+    os.environ["OPENAI_BASE_URL"] = base_url + "/v1"
+    os.environ["ELEVENLABS_BASE_URL"] = base_url
+    os.environ["OPENAI_REALTIME_URL"] = realtime_url.replace("http", "ws") + "/v1/realtime"
+    os.environ.setdefault("SESSION_JOURNAL_PATH", "")
+
+    from main import app
+
+    app_url, app_server = serve_in_thread(app)
+    try:
+        checks, first_audio = asyncio.run(run(app_url, args, realtime))
+    finally:
+        app_server.should_exit = True
+        realtime_server.should_exit = True
+        server.should_exit = True
+
+    print(f"end of speech -> first assistant audio  {first_audio:.3f}s")
+    for check, passed in checks.items():
+        print(f"{'✅' if passed else '❌'} {check}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# Turn latency and outcomes under injected provider faults, with the retry/hedge/breaker
+# layer on and off. "flaky" fails and slows a fraction of every provider's calls;
+# "tts-outage" fails every ElevenLabs call, so the breaker opens and turns go text-only.
+#
+#   python -m benchmarks.resilience --turns 120 --error-rate 0.1 --slow-rate 0.05
+import io
+import os
+import time
+import asyncio
+import argparse
+import itertools
+import contextlib
+import httpx
+from benchmarks.fake_providers import create_app, serve_in_thread
+from benchmarks.loadtest import percentile
+
+AUDIO = ("recording.webm", b"\x1aE\xdf\xa3" + b"\x00" * 1024, "audio/webm")
+STAGES = ("stt", "extract", "chat", "tts")
+_replies = itertools.count()
+
+
+def varied_reply():
+    return f"Got it, noted as item {next(_replies)}. What is the legal corporate name of the business?"
+
+
+def use_guards(resilient):
+    import providers
+    from resilience import StageGuard
+    for stage, timeout in providers.STAGE_TIMEOUTS.items():
+        if resilient:
+            providers.guards[stage] = StageGuard(stage, timeout)
+        else:
+            providers.guards[stage] = StageGuard(stage, timeout, max_attempts=1, hedge=False)
+            providers.guards[stage].breaker.failure_threshold = float("inf")
+
+
+async def run_turns(client, turns, concurrency):
+    from realtime_assistant import FALLBACK_REPLY, NEXT_FIELD_TEMPLATE
+    degraded_prefix = NEXT_FIELD_TEMPLATE.split("{")[0]
+    results = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def turn(index):
+        async with limit:
+            started = time.perf_counter()
+            response = await client.post("/voice-stream", files={"audio": AUDIO},
+                                         headers={"X-Session-Id": f"resilience{index % concurrency}"})
+            elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                results.append((elapsed, "error"))
+                return
+            body = response.json()
+            text = body.get("assistant_text", "")
+            if text == FALLBACK_REPLY or text.startswith(degraded_prefix):
+                results.append((elapsed, "degraded"))
+            elif body.get("audio_base64") is None:
+                results.append((elapsed, "text_only"))
+            else:
+                results.append((elapsed, "ok"))
+
+    await asyncio.gather(*(turn(i) for i in range(turns)))
+    return results
+
+
+async def scenario(app, fake, faults, resilient, turns, concurrency):
+    use_guards(resilient)
+    fake.state.faults = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+        # Fault-free warm-up so the hedging thresholds have latency samples.
+        await run_turns(client, 30, concurrency)
+        fake.state.faults = faults
+        calls_before = dict(fake.state.calls)
+        started = time.perf_counter()
+        results = await run_turns(client, turns, concurrency)
+        elapsed = time.perf_counter() - started
+    calls = {stage: fake.state.calls[stage] - calls_before[stage] for stage in fake.state.calls}
+    return results, elapsed, calls
+
+
+def summarize(name, results, calls):
+    latencies = sorted(elapsed for elapsed, _ in results)
+    outcomes = {kind: sum(1 for _, outcome in results if outcome == kind)
+                for kind in ("ok", "text_only", "degraded", "error")}
+    print(f"{name:<24} p50 {percentile(latencies, 0.5):5.2f}s  p95 {percentile(latencies, 0.95):5.2f}s  "
+          f"p99 {percentile(latencies, 0.99):5.2f}s  {outcomes}  provider calls {calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=120)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-factor", type=float, default=8)
+    args = parser.parse_args()
+
+    fake = create_app(reply=varied_reply, jitter=0.2)
+    base_url, server = serve_in_thread(fake)
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    os.environ.setdefault("ELEVENLABS_API_KEY", "test")
+    os.environ["OPENAI_BASE_URL"] = base_url + "/v1"
+    os.environ["ELEVENLABS_BASE_URL"] = base_url
+    # Session ids repeat between runs, so do not resume sessions journaled by a previous run.
+    os.environ.setdefault("SESSION_JOURNAL_PATH", "")
+    os.environ.setdefault("PROVIDER_BREAKER_RESET_SECONDS", "60")
+
+    from main import app
+
+    flaky = {stage: {"error_rate": args.error_rate, "slow_rate": args.slow_rate, "slow_factor": args.slow_factor}
+             for stage in STAGES}
+    outage = {"tts": {"error_rate": 1.0}}
+
+    async def run_all():
+        rows = []
+        for label, faults in (("flaky", flaky), ("tts-outage", outage)):
+            for resilient in (False, True):
+                results, _, calls = await scenario(app, fake, faults, resilient, args.turns, args.concurrency)
+                rows.append((f"{label} {'guarded' if resilient else 'unguarded'}", results, calls))
+        return rows
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = asyncio.run(run_all())
+    for name, results, calls in rows:
+        summarize(name, results, calls)
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
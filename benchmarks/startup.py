@@ -0,0 +1,111 @@
+# Cold start: how long a fresh `uvicorn main:app` process takes to import the app and
+# bind its port, and how long the first requests take right at bind time compared with
+# the same requests once the background warm-up has finished. Each run starts with an
+# empty TTS disk cache, as on a scale-to-zero platform.
+#
+#   python -m benchmarks.startup --runs 5
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import tempfile
+import httpx
+from benchmarks.fake_providers import DEFAULT_LATENCY, create_app, serve_in_thread, free_port
+
+AUDIO = {"audio": ("recording.webm", b"\x1aE\xdf\xa3" + b"\x00" * 1024, "audio/webm")}
+
+
+def import_seconds(env):
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-W", "ignore", "-c", code], env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.005)
+    raise TimeoutError("server did not bind its port")
+
+
+def first_requests(client, session_id):
+    headers = {"X-Session-Id": session_id}
+    timings = {}
+    for name, send in (
+        ("/initial-message", lambda: client.get("/initial-message", headers=headers)),
+        ("/voice-stream", lambda: client.post("/voice-stream", files=AUDIO, headers=headers)),
+        ("/confirm", lambda: client.post("/confirm", json={"confirmed": True}, headers=headers)),
+    ):
+        started = time.perf_counter()
+        send().raise_for_status()
+        timings[name] = time.perf_counter() - started
+    return timings
+
+
+def one_run(env, settle):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-W", "ignore", "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            env={**env, "TTS_CACHE_DIR": cache_dir}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(port, process)
+            bind = time.perf_counter() - started
+            with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+                cold = first_requests(client, "cold")
+                time.sleep(settle)
+                warm = first_requests(client, "warm")
+        finally:
+            process.terminate()
+            process.wait()
+    return bind, cold, warm
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--settle", type=float, default=3.0, help="seconds to wait for the warm-up")
+    args = parser.parse_args()
+
+    # Instant stand-ins, so the numbers are the app's own start-up and first-use costs.
+    base_url, server = serve_in_thread(create_app({stage: 0.0 for stage in DEFAULT_LATENCY}))
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "test",
+        "ELEVENLABS_API_KEY": "test",
+        "OPENAI_BASE_URL": base_url + "/v1",
+        "ELEVENLABS_BASE_URL": base_url,
+        "SESSION_JOURNAL_PATH": "",
+    }
+
+    imports = [import_seconds(env) for _ in range(args.runs)]
+    binds, colds, warms = [], [], []
+    for _ in range(args.runs):
+        bind, cold, warm = one_run(env, args.settle)
+        binds.append(bind)
+        colds.append(cold)
+        warms.append(warm)
+    server.should_exit = True
+
+    print(f"import main          median {statistics.median(imports):.3f}s")
+    print(f"spawn -> port bound  median {statistics.median(binds):.3f}s")
+    print(f"{'first request':<20} {'at bind':>9} {'after warm-up':>14}")
+    for endpoint in colds[0]:
+        cold = statistics.median(run[endpoint] for run in colds)
+        warm = statistics.median(run[endpoint] for run in warms)
+        print(f"{endpoint:<20} {cold:>8.3f}s {warm:>13.3f}s")
+
+
+if __name__ == "__main__":
+    main()
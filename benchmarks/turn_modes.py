@@ -0,0 +1,86 @@
+# Per-turn latency of the sequential, speculative and merged turn modes against a
+# stub with configurable extraction and dialogue latencies. Every mode must fill the
+# same fields, and speculative and merged must beat sequential by --min-speedup, or
+# the run exits non-zero.
+#
+#   python -m benchmarks.turn_modes --extract 0.8 --chat 0.6 --turns 5
+import os
+import sys
+import time
+import asyncio
+import argparse
+from benchmarks.fake_providers import create_app, serve_in_thread
+
+MODES = ("sequential", "speculative", "merged")
+USER_TEXT = "It's called Jane's Burgers."
+
+
+async def one_turn(mode, session_id):
+    from realtime_assistant import process_transcribed_text
+    from session_store import SessionState
+
+    state = SessionState(session_id)
+    started = time.perf_counter()
+    await process_transcribed_text(state, USER_TEXT, mode=mode)
+    return time.perf_counter() - started, state.form_data
+
+
+async def run_mode(mode, turns):
+    # Each timed turn answers the same question on a fresh session, so the turns do
+    # the same work; the untimed first turn pays for client and connection set-up.
+    await one_turn(mode, f"bench-{mode}-warmup")
+    timings, forms = [], []
+    for turn in range(turns):
+        seconds, form = await one_turn(mode, f"bench-{mode}-{turn}")
+        timings.append(seconds)
+        forms.append(form)
+    return sum(timings) / len(timings), forms
+
+
+async def run_all(turns):
+    return {mode: await run_mode(mode, turns) for mode in MODES}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--extract", type=float, default=0.8, help="gpt-4 extraction latency (s)")
+    parser.add_argument("--chat", type=float, default=0.6, help="gpt-4o dialogue latency (s)")
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--min-speedup", type=float, default=1.2,
+                        help="required sequential / speculative and sequential / merged turn time")
+    args = parser.parse_args()
+
+    fake = create_app({"extract": args.extract, "chat": args.chat}, fill_form=True)
+    base_url, server = serve_in_thread(fake)
+    os.environ["OPENAI_API_KEY"] = "test"
+    os.environ["OPENAI_BASE_URL"] = base_url + "/v1"
+    os.environ.setdefault("SESSION_JOURNAL_PATH", "")
+
+    try:
+        results = asyncio.run(run_all(args.turns))
+    finally:
+        server.should_exit = True
+
+    sequential, expected_forms = results["sequential"]
+    for mode, (seconds, _) in results.items():
+        print(f"{mode:<12} {seconds * 1000:7.0f} ms/turn  ({sequential / seconds:.2f}x sequential)")
+    print(f"provider calls: {fake.state.calls}")
+
+    failures = []
+    if any(form["SiteCompanyName1"] != "Jane's Burgers" for form in expected_forms):
+        failures.append("sequential did not fill the DBA name")
+    for mode in ("speculative", "merged"):
+        seconds, forms = results[mode]
+        if forms != expected_forms:
+            failures.append(f"{mode} filled a different form than sequential")
+        if sequential / seconds < args.min_speedup:
+            failures.append(f"{mode} is {sequential / seconds:.2f}x sequential, below {args.min_speedup:.2f}x")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ within gates")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
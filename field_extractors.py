@@ -0,0 +1,238 @@
+import re
+
+# Rule-based extractors for fields with a fixed shape. They run before the LLM
+# extraction call, and when they fully answer the question the assistant just
+# asked, that call is skipped. Confidences reflect how the value was parsed:
+# taken verbatim from the transcript scores higher than rebuilt from spoken words.
+
+DIGIT_WORDS = {
+    "zero": "0", "oh": "0", "o": "0", "one": "1", "two": "2", "three": "3", "four": "4",
+    "five": "5", "six": "6", "seven": "7", "eight": "8", "nine": "9",
+}
+REPEAT_WORDS = {"double": 2, "triple": 3}
+
+US_STATES = {
+    "alabama": "AL", "alaska": "AK", "arizona": "AZ", "arkansas": "AR", "california": "CA",
+    "colorado": "CO", "connecticut": "CT", "delaware": "DE", "florida": "FL", "georgia": "GA",
+    "hawaii": "HI", "idaho": "ID", "illinois": "IL", "indiana": "IN", "iowa": "IA",
+    "kansas": "KS", "kentucky": "KY", "louisiana": "LA", "maine": "ME", "maryland": "MD",
+    "massachusetts": "MA", "michigan": "MI", "minnesota": "MN", "mississippi": "MS",
+    "missouri": "MO", "montana": "MT", "nebraska": "NE", "nevada": "NV", "new hampshire": "NH",
+    "new jersey": "NJ", "new mexico": "NM", "new york": "NY", "north carolina": "NC",
+    "north dakota": "ND", "ohio": "OH", "oklahoma": "OK", "oregon": "OR", "pennsylvania": "PA",
+    "rhode island": "RI", "south carolina": "SC", "south dakota": "SD", "tennessee": "TN",
+    "texas": "TX", "utah": "UT", "vermont": "VT", "virginia": "VA", "washington": "WA",
+    "west virginia": "WV", "wisconsin": "WI", "wyoming": "WY", "district of columbia": "DC",
+}
+STATE_CODES = frozenset(US_STATES.values())
+
+# Longest names first so "west virginia" wins over "virginia".
+STATE_NAME_RE = re.compile(
+    r"\b(" + "|".join(sorted((re.escape(name) for name in US_STATES), key=len, reverse=True)) + r")\b"
+)
+STATE_CODE_RE = re.compile(r"\b([A-Z]{2})\b")
+EMAIL_RE = re.compile(r"\b[a-z0-9][a-z0-9._%+-]*@[a-z0-9-]+(?:\.[a-z0-9-]+)*\.[a-z]{2,}\b")
+WEBSITE_RE = re.compile(
+    r"\b(?:https?://)?((?:www\.)?[a-z0-9][a-z0-9-]*(?:\.[a-z0-9-]+)*\.(?:com|net|org|biz|info|us|co|io|shop|store))\b"
+)
+ZIP_RE = re.compile(r"(?<!\d)(\d{5})(?:-(\d{4}))?(?!\d)")
+PHONE_RE = re.compile(r"(?<!\d)(?:\+?1[\s.-]?)?\(?(\d{3})\)?[\s.-]?(\d{3})[\s.-]?(\d{4})(?!\d)")
+
+SPOKEN_EMAIL = [
+    (re.compile(r"\s+(?:at sign|at)\s+"), "@"),
+    (re.compile(r"\s+(?:dot|period|point)\s+"), "."),
+    (re.compile(r"\s+(?:underscore|under score)\s+"), "_"),
+    (re.compile(r"\s+(?:dash|hyphen)\s+"), "-"),
+]
+SPOKEN_DOT = re.compile(r"\s+(?:dot|period|point)\s+")
+
+# What the assistant's question asks about, in match order.
+QUESTION_TOPICS = [
+    ("customer service email", re.compile(r"customer\s*(?:service|support)\s*e-?mail")),
+    ("email", re.compile(r"e-?mail")),
+    ("zip", re.compile(r"\bzip\b|postal")),
+    ("fax", re.compile(r"\bfax\b")),
+    ("phone", re.compile(r"phone|telephone|\bvoice\b|contact number")),
+    ("website", re.compile(r"web\s*site|\burl\b|\bdomain\b")),
+    ("state", re.compile(r"\bstate\b")),
+]
+# Topics only the LLM can extract; a question about any of these always goes to it.
+LLM_TOPICS = re.compile(
+    r"\bcity\b|address|\bname\b|\bdba\b|\bmcc\b|description|retrieval|initials|signature|business type"
+)
+# The dialogue asks for Corporate* phone, fax and email as the "contact" ones.
+CORPORATE_HINT = re.compile(r"corporate|billing|legal|headquarters|\bcorp\b|\bcontact\b")
+# A topic's shape can belong to a field the rules don't fill; such answers are left to the LLM.
+OTHER_FIELD_HINTS = {
+    "fax": re.compile(r"retrieval"),
+}
+
+CONFIDENCE_VERBATIM = 0.97
+CONFIDENCE_SPOKEN = 0.85
+CONFIDENCE_AMBIGUOUS = 0.6
+
+
+def spoken_digits(text):
+    # "two one seven double five" -> "21755"; digits already written pass through.
+    parts = []
+    repeat = 1
+    for token in re.findall(r"[a-z]+|\d+|[-().+]", text.lower()):
+        if token in REPEAT_WORDS:
+            repeat = REPEAT_WORDS[token]
+            continue
+        if token in DIGIT_WORDS:
+            parts.append(DIGIT_WORDS[token] * repeat)
+        elif token.isdigit():
+            parts.append(token * repeat if len(token) == 1 else token)
+        elif token in "-().+":
+            parts.append(token)
+        else:
+            parts.append(" ")
+        repeat = 1
+    return re.sub(r"\s+", " ", "".join(parts)).strip()
+
+
+def _single(candidates, verbatim):
+    if not candidates:
+        return None
+    value = candidates[0]
+    if len(set(candidates)) > 1:
+        return {"value": value, "confidence": CONFIDENCE_AMBIGUOUS}
+    return {"value": value, "confidence": CONFIDENCE_VERBATIM if verbatim else CONFIDENCE_SPOKEN}
+
+
+def extract_email(text):
+    lowered = text.lower()
+    found = EMAIL_RE.findall(lowered)
+    if found:
+        return _single(found, verbatim=True)
+    spoken = " " + lowered + " "
+    for pattern, symbol in SPOKEN_EMAIL:
+        spoken = pattern.sub(symbol, spoken)
+    return _single(EMAIL_RE.findall(spoken.strip()), verbatim=False)
+
+
+def extract_website(text):
+    lowered = text.lower()
+    without_emails = EMAIL_RE.sub(" ", lowered)
+    found = WEBSITE_RE.findall(without_emails)
+    if found:
+        return _single(found, verbatim=True)
+    spoken = SPOKEN_DOT.sub(".", " " + without_emails + " ").strip()
+    found = WEBSITE_RE.findall(spoken)
+    if not found:
+        return None
+    # Only the word right before "dot" is kept, so "janes burgers dot com" is a guess.
+    return {"value": found[0], "confidence": CONFIDENCE_AMBIGUOUS}
+
+
+def extract_zip(text):
+    found = ZIP_RE.findall(text)
+    verbatim = bool(found)
+    if not found:
+        found = ZIP_RE.findall(spoken_digits(text))
+    return _single(["-".join(part for part in match if part) for match in found], verbatim)
+
+
+def extract_phone(text):
+    found = PHONE_RE.findall(text)
+    verbatim = bool(found)
+    if not found:
+        found = PHONE_RE.findall(spoken_digits(text))
+    return _single(["-".join(match) for match in found], verbatim)
+
+
+def extract_state(text):
+    names = [US_STATES[name] for name in STATE_NAME_RE.findall(text.lower())]
+    if names:
+        return _single(names, verbatim=True)
+    codes = [code for code in STATE_CODE_RE.findall(text) if code in STATE_CODES]
+    if codes:
+        # Two capital letters could be something else ("OK", "IN"), so score it lower.
+        return _single(codes, verbatim=False)
+    return None
+
+
+TOPIC_FIELDS = {
+    "customer service email": ("CustomerSvcEmail", "CustomerSvcEmail", extract_email),
+    "email": ("SiteEmail", "CorporateEmail", extract_email),
+    "zip": ("SiteZip", "CorporateZip", extract_zip),
+    "fax": ("SiteFax", "CorporateFax", extract_phone),
+    "phone": ("SiteVoice", "CorporateVoice", extract_phone),
+    "website": ("BusinessWebsite", "BusinessWebsite", extract_website),
+    "state": ("SiteState", "CorporateState", extract_state),
+}
+
+
+class FastExtraction:
+    __slots__ = ("fields", "answered")
+
+    def __init__(self, fields, answered):
+        self.fields = fields
+        self.answered = answered
+
+
+def asked_topics(question):
+    question = question.lower()
+    topics = []
+    for topic, pattern in QUESTION_TOPICS:
+        if pattern.search(question):
+            topics.append(topic)
+            # "customer service email" should not also count as a plain email question.
+            question = pattern.sub(" ", question)
+    return topics
+
+
+def asked_fields(question):
+    # The (field, extractor) pairs a question asks for, and whether the rules can answer
+    # all of it: False when part of the question needs the LLM.
+    question = question or ""
+    lowered_question = question.lower()
+    topics = asked_topics(question)
+    corporate = bool(CORPORATE_HINT.search(lowered_question))
+    extractor_uses = {}
+    for topic in topics:
+        extractor = TOPIC_FIELDS[topic][2]
+        extractor_uses[extractor] = extractor_uses.get(extractor, 0) + 1
+
+    targets = []
+    complete = bool(topics) and not LLM_TOPICS.search(lowered_question)
+    for topic in topics:
+        site_field, corporate_field, extractor = TOPIC_FIELDS[topic]
+        if extractor_uses[extractor] > 1:
+            # Two emails or two phone numbers in one answer: leave the pairing to the LLM.
+            complete = False
+            continue
+        other_field = OTHER_FIELD_HINTS.get(topic)
+        if other_field is not None and other_field.search(lowered_question):
+            # "What's the retrieval fax number?" must not land in SiteFax.
+            complete = False
+            continue
+        targets.append((corporate_field if corporate else site_field, extractor))
+    return targets, complete
+
+
+def fast_extract(question, user_text):
+    # Returns fields in the same {"Field": {"value", "confidence"}} shape the LLM
+    # extraction produces. answered is True when every field the question asks for
+    # was found locally with good confidence and nothing in the question needs the LLM.
+    targets, answered = asked_fields(question)
+    fields = {}
+    for field, extractor in targets:
+        result = extractor(user_text)
+        if result is None or result["confidence"] < CONFIDENCE_SPOKEN:
+            answered = False
+        if result is not None:
+            fields[field] = result
+    return FastExtraction(fields, answered)
+
+
+def merge_extractions(llm_fields, local_fields):
+    # Local results win when at least as confident as the LLM's guess.
+    merged = dict(llm_fields)
+    for key, local in local_fields.items():
+        guess = merged.get(key)
+        llm_confidence = guess.get("confidence", 1) if isinstance(guess, dict) else (0 if guess is None else 1)
+        if local["confidence"] >= llm_confidence:
+            merged[key] = local
+    return merged
@@ -1,12 +1,21 @@
+import os
 import sys
 import json
 import io
-import fitz  # PyMuPDF
-from PIL import Image
+import struct
+import hashlib
+import tempfile
 
-def extract_form_fields(pdf_path):
+# PyMuPDF and Pillow are imported where they are used, so importing this module does
+# not load them; the web app parses the template after it has started serving.
+
+def extract_form_fields(pdf_source):
+    import fitz  # PyMuPDF
     fields = {}
-    doc = fitz.open(pdf_path)
+    if isinstance(pdf_source, bytes):
+        doc = fitz.open(stream=pdf_source, filetype="pdf")
+    else:
+        doc = fitz.open(pdf_source)
     for page_num, page in enumerate(doc):
         widgets = page.widgets()
         for widget in widgets:
@@ -22,7 +31,163 @@ def extract_form_fields(pdf_path):
     doc.close()
     return fields
 
-def fill_pdf(input_pdf_path, output_pdf_path, data):
+class FieldLayout:
+    __slots__ = ("page", "rect", "font_size", "x", "y")
+
+    def __init__(self, page, rect):
+        x0, y0, x1, y1 = rect
+        self.page = page
+        self.rect = rect
+        self.font_size = min(11, (y1 - y0) - 2)
+        # Text baseline, three quarters of the way down the widget.
+        self.x = x0 + 2
+        self.y = y0 + (y1 - y0) * 0.75
+
+
+class PdfTemplate:
+    # Parses the template once; each render opens a fresh document from the cached bytes.
+    def __init__(self, pdf_path):
+        with open(pdf_path, "rb") as f:
+            self.pdf_bytes = f.read()
+        self.digest = hashlib.sha256(self.pdf_bytes).hexdigest()
+        self.fields = {
+            name: FieldLayout(info["page"], info["rect"])
+            for name, info in extract_form_fields(self.pdf_bytes).items()
+        }
+
+    def render(self, data, signature_png=None):
+        # PyMuPDF writes to a file far faster than through its Python-level byte stream,
+        # so render into a scratch file and read the bytes back.
+        with tempfile.TemporaryDirectory() as scratch:
+            path = os.path.join(scratch, "filled.pdf")
+            self.render_to(path, data, signature_png)
+            with open(path, "rb") as f:
+                return f.read()
+
+    def render_to(self, output_pdf_path, data, signature_png=None):
+        import fitz
+        data = prepare_fill_data(data)
+        doc = fitz.open(stream=self.pdf_bytes, filetype="pdf")
+        try:
+            # One shape per page, so each page gets a single new content stream.
+            shapes = {}
+            for field_name, layout in self.fields.items():
+                value = data.get(field_name)
+                if value:
+                    shape = shapes.get(layout.page)
+                    if shape is None:
+                        shape = shapes[layout.page] = doc[layout.page].new_shape()
+                    shape.insert_text((layout.x, layout.y), str(value), fontsize=layout.font_size, fontname="helv")
+            for shape in shapes.values():
+                shape.commit()
+            if signature_png:
+                self._insert_signature(doc, signature_png)
+            # Keep the template ID so identical input renders to identical bytes.
+            doc.save(output_pdf_path, incremental=False, deflate=True, no_new_id=True)
+        finally:
+            doc.close()
+
+    def signature_box(self):
+        # Largest signature widget, in points; uploads are scaled to fit it once.
+        rects = [self.fields[name].rect for name in SIGNATURE_FIELDS if name in self.fields]
+        if not rects:
+            return None
+        return max(r[2] - r[0] for r in rects), max(r[3] - r[1] for r in rects)
+
+    def _insert_signature(self, doc, signature_png):
+        import fitz
+        try:
+            img_width, img_height = png_size(signature_png)
+        except ValueError:
+            signature_png = to_png(signature_png)
+            img_width, img_height = png_size(signature_png)
+
+        xref = 0
+        for sig_field in SIGNATURE_FIELDS:
+            layout = self.fields.get(sig_field)
+            if layout is None:
+                continue
+            x0, y0, x1, y1 = layout.rect
+            rect_width = x1 - x0
+            rect_height = y1 - y0
+            scale = min(rect_width / img_width, rect_height / img_height)
+            new_width = img_width * scale
+            new_height = img_height * scale
+            x_centered = x0 + (rect_width - new_width) / 2
+            y_centered = y0 + (rect_height - new_height) / 2
+            target = fitz.Rect(x_centered, y_centered, x_centered + new_width, y_centered + new_height)
+
+            # Embed the image once and point later signature fields at the same xref.
+            if xref:
+                doc[layout.page].insert_image(target, xref=xref)
+            else:
+                xref = doc[layout.page].insert_image(target, stream=signature_png)
+
+
+SIGNATURE_FIELDS = ("signer1signature1", "signer1signature2")
+
+_templates = {}
+
+
+def get_template(pdf_path):
+    template = _templates.get(pdf_path)
+    if template is None:
+        template = _templates[pdf_path] = PdfTemplate(pdf_path)
+    return template
+
+
+def png_size(image_bytes):
+    if image_bytes[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("not a PNG image")
+    return struct.unpack(">II", image_bytes[16:24])
+
+
+def to_png(image_bytes):
+    from PIL import Image
+    img_byte_arr = io.BytesIO()
+    Image.open(io.BytesIO(image_bytes)).save(img_byte_arr, format="PNG")
+    return img_byte_arr.getvalue()
+
+
+# Pixels per point kept for the signature (3 -> 216 dpi), and the grey level below which
+# a pixel counts as ink.
+SIGNATURE_PIXELS_PER_POINT = 3
+SIGNATURE_INK_THRESHOLD = 200
+
+
+def normalize_signature(image_bytes, box=None):
+    # Crops a drawn signature to its ink, scales it down to fit the signature box and
+    # stores it as a 1-bit PNG with a transparent background, ready to embed as is.
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    gray = image.convert("L")
+
+    ink = gray.point(lambda v: 255 if v < SIGNATURE_INK_THRESHOLD else 0)
+    bbox = ink.getbbox()
+    if bbox is None:
+        raise ValueError("signature is empty")
+    gray = gray.crop(bbox)
+
+    if box is not None:
+        max_size = (int(box[0] * SIGNATURE_PIXELS_PER_POINT), int(box[1] * SIGNATURE_PIXELS_PER_POINT))
+        if gray.width > max_size[0] or gray.height > max_size[1]:
+            gray = ImageOps.contain(gray, max_size, Image.LANCZOS)
+
+    signature = Image.new("P", gray.size, 0)
+    signature.putpalette([255, 255, 255, 0, 0, 0])
+    signature.paste(1, mask=gray.point(lambda v: 255 if v < SIGNATURE_INK_THRESHOLD else 0))
+    output = io.BytesIO()
+    signature.save(output, format="PNG", transparency=0, optimize=True, bits=1)
+    return output.getvalue()
+
+
+def prepare_fill_data(data):
+    data = dict(data)
     # Propagate single initials/signature
     if "MerchantInitials" in data:
         for i in range(1, 8):
@@ -34,55 +199,18 @@ def fill_pdf(input_pdf_path, output_pdf_path, data):
     for key in list(data.keys()):
         if data[key] in ("null", None):
             data[key] = ""
+    return data
 
-    print("Extracting field positions...")
-    fields = extract_form_fields(input_pdf_path)
-    doc = fitz.open(input_pdf_path)
-
-    for field_name, field_info in fields.items():
-        if field_name in data and data[field_name]:
-            value = data[field_name]
-            page = doc[field_info['page']]
-            x0, y0, x1, y1 = field_info['rect']
-            font_size = min(11, (y1 - y0) - 2)
-            x_pos = x0 + 2
-            y_pos = y0 + (y1 - y0) * 0.75
 
-            print(f"Field: {field_name}, Value: {value}")
-            page.insert_text((x_pos, y_pos), str(value), fontsize=font_size, fontname="helv")
-
-    # Insert signature image if exists
+def fill_pdf(input_pdf_path, output_pdf_path, data, signature_path="saved_signature.png"):
     try:
-        sig_path = "saved_signature.png"
-        img = Image.open(sig_path)
-        img_width, img_height = img.size
-
-        for sig_field in ["signer1signature1", "signer1signature2"]:
-            if sig_field in fields:
-                field = fields[sig_field]
-                page = doc[field['page']]
-                x0, y0, x1, y1 = field['rect']
-                rect_width = x1 - x0
-                rect_height = y1 - y0
-                scale = min(rect_width / img_width, rect_height / img_height)
-                new_width = img_width * scale
-                new_height = img_height * scale
-                x_centered = x0 + (rect_width - new_width) / 2
-                y_centered = y0 + (rect_height - new_height) / 2
-
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format='PNG')
-                page.insert_image(
-                    fitz.Rect(x_centered, y_centered, x_centered + new_width, y_centered + new_height),
-                    stream=img_byte_arr.getvalue()
-                )
-                print(f"Signature inserted at {sig_field}")
-    except Exception as e:
+        with open(signature_path, "rb") as f:
+            signature_png = f.read()
+    except OSError as e:
         print("⚠️ Signature image not inserted:", e)
+        signature_png = None
 
-    print(f"Saving to: {output_pdf_path}")
-    doc.save(output_pdf_path, incremental=False, deflate=True)
-    doc.close()
+    get_template(input_pdf_path).render_to(output_pdf_path, data, signature_png)
     print(f"✅ PDF saved to {output_pdf_path}")
 
 def load_json_data(json_file_path):
@@ -90,6 +218,9 @@ def load_json_data(json_file_path):
         return json.load(file)
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        from pdf_batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
     if len(sys.argv) == 4:
         input_pdf_path = sys.argv[1]
         json_file_path = sys.argv[2]
@@ -98,3 +229,4 @@ if __name__ == "__main__":
         fill_pdf(input_pdf_path, output_pdf_path, field_values)
     else:
         print("Usage: python pdf_text_overlay.py <input_pdf_path> <json_file_path> <output_pdf_path>")
+        print("       python pdf_text_overlay.py --batch <input_pdf_path> <records.jsonl> <output_dir|output.zip> [--workers N]")
@@ -1,54 +1,112 @@
 # gpt4o_realtime_ws.py
 
 import asyncio
-import websockets
 import base64
 import json
 import os
+from contextlib import asynccontextmanager
+from websockets.asyncio.client import connect
 from dotenv import load_dotenv
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+REALTIME_URL = os.getenv("OPENAI_REALTIME_URL", "wss://api.openai.com/v1/realtime")
+REALTIME_MODEL = "gpt-4o-realtime-preview-2025-06-03"
 
-async def gpt4o_realtime_audio_stream(audio_generator):
-    uri = "wss://api.openai.com/v1/audio/ws"
+# pcm16 mono at 24 kHz in both directions.
+SAMPLE_RATE = 24000
+
+
+class RealtimeConnection:
+    # Thin wrapper over the realtime websocket that speaks in simplified events:
+    #   {"type": "audio", "audio": bytes}          assistant audio
+    #   {"type": "text", "text": str}              assistant transcript delta
+    #   {"type": "assistant_text", "text": str}    assistant transcript, complete
+    #   {"type": "user_text", "text": str}         user transcript, complete
+    #   {"type": "speech_started"}                 user started talking (barge-in)
+    #   {"type": "response_started" | "response_done"}
+    #   {"type": "error", "error": dict}
+    def __init__(self, websocket):
+        self.websocket = websocket
+
+    async def send_event(self, event):
+        await self.websocket.send(json.dumps(event))
+
+    async def configure(self, instructions):
+        await self.send_event({
+            "type": "session.update",
+            "session": {
+                "instructions": instructions,
+                "modalities": ["text", "audio"],
+                "input_audio_format": "pcm16",
+                "output_audio_format": "pcm16",
+                "input_audio_transcription": {"model": "whisper-1"},
+                "turn_detection": {"type": "server_vad", "silence_duration_ms": 500},
+            }
+        })
+
+    async def send_audio(self, chunk):
+        await self.send_event({
+            "type": "input_audio_buffer.append",
+            "audio": base64.b64encode(chunk).decode("utf-8")
+        })
+
+    async def cancel_response(self):
+        await self.send_event({"type": "response.cancel"})
+
+    async def say(self, text):
+        await self.send_event({
+            "type": "response.create",
+            "response": {"instructions": f"Say exactly this and nothing else: {text}"}
+        })
+
+    async def events(self):
+        async for message in self.websocket:
+            msg = json.loads(message)
+            kind = msg.get("type")
+            if kind == "response.audio.delta":
+                yield {"type": "audio", "audio": base64.b64decode(msg["delta"])}
+            elif kind == "response.audio_transcript.delta":
+                yield {"type": "text", "text": msg["delta"]}
+            elif kind == "response.audio_transcript.done":
+                yield {"type": "assistant_text", "text": msg["transcript"]}
+            elif kind == "conversation.item.input_audio_transcription.completed":
+                yield {"type": "user_text", "text": msg["transcript"]}
+            elif kind == "input_audio_buffer.speech_started":
+                yield {"type": "speech_started"}
+            elif kind == "response.created":
+                yield {"type": "response_started"}
+            elif kind == "response.done":
+                yield {"type": "response_done"}
+            elif kind == "error":
+                yield {"type": "error", "error": msg.get("error", {})}
+
+
+@asynccontextmanager
+async def open_realtime(instructions=None):
     headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}"
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "OpenAI-Beta": "realtime=v1",
     }
+    uri = f"{REALTIME_URL}?model={REALTIME_MODEL}"
+    async with connect(uri, additional_headers=headers, ping_interval=20, max_size=None) as websocket:
+        connection = RealtimeConnection(websocket)
+        if instructions:
+            await connection.configure(instructions)
+        yield connection
 
-    async with websockets.connect(uri, extra_headers=headers, ping_interval=None) as websocket:
-        # Send config message to OpenAI
-        await websocket.send(json.dumps({
-            "model": "gpt-4o-realtime-preview-2025-06-03",
-            "audio": {
-                "encoding": "mp3",
-                "sample_rate": 24000,
-            },
-            "text": {"return_as_text": True},
-        }))
 
+async def gpt4o_realtime_audio_stream(audio_generator, instructions=None):
+    # Sends every chunk from audio_generator upstream while yielding events as they arrive.
+    async with open_realtime(instructions) as connection:
         async def send_audio():
             async for chunk in audio_generator:
-                await websocket.send(chunk)
-            await websocket.send("[DONE]")
-
-        async def receive_audio():
-            async for message in websocket:
-                if isinstance(message, bytes):
-                    yield {"type": "audio", "audio": message}
-                else:
-                    msg = json.loads(message)
-                    if "text" in msg:
-                        yield {"type": "text", "text": msg["text"]}
-                    if msg.get("type") == "tool_use":
-                        yield {"type": "tool_use", "data": msg}
-
-        await asyncio.gather(send_audio(), receive_audio())
-
-# Example usage
-# You'll integrate this with FastAPI or a frontend WebSocket endpoint
-
-# For a FastAPI WebSocket route, you can:
-# - Accept audio chunks from frontend
-# - Feed to `gpt4o_realtime_audio_stream`
-# - Yield audio + text back to frontend in real-time
+                await connection.send_audio(chunk)
+            await connection.send_event({"type": "input_audio_buffer.commit"})
+
+        sender = asyncio.create_task(send_audio())
+        try:
+            async for event in connection.events():
+                yield event
+        finally:
+            sender.cancel()
@@ -1,30 +1,97 @@
 import os
+import time
+import asyncio
 import base64
 import tempfile
 import traceback
-from fastapi import FastAPI, UploadFile, File, Request
-from fastapi.responses import JSONResponse, FileResponse
+from contextlib import asynccontextmanager, aclosing
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import FastAPI, UploadFile, File, Request, Depends, WebSocket
+from starlette.background import BackgroundTask
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from openai import OpenAI
-from elevenlabs.client import ElevenLabs
-from fill_pdf_logic import fill_pdf
+from fill_pdf_logic import get_template, normalize_signature
+from pdf_batch import render_batch, write_to_zip, SharedPool
+from pdf_artifacts import artifact_store, artifact_key, normalize_form_data
 from realtime_assistant import (
+    FALLBACK_REPLY,
+    GREETINGS,
     process_transcribed_text,
-    form_data,
-    conversation_history,
+    fixed_utterances,
+    is_fixed_utterance,
     get_initial_assistant_message,
-    end_triggered,
     reset_assistant_state
 )
+from voice_relay import relay_voice
+from reply_stream import stream_reply_events, sse_event
+from transcription import utterances, transcribe_segments, IncompleteUtterance, BufferFull, INCREMENTAL_UPLOADS
+from providers import (
+    synthesize,
+    audio_key,
+    prewarm_tts,
+    warm_connection,
+    aclose as close_providers
+)
+from tts_cache import tts_cache
+from session_journal import share_audio, shared_audio, close as close_journal
+from metrics import timed, fallbacks, request_duration, start_request, server_timing, render_metrics
+from session_store import (
+    sessions,
+    new_session_id,
+    session_id_from_request,
+    SESSION_COOKIE,
+    SESSION_TTL_SECONDS
+)
 
 # Load environment variables
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-eleven_client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
+PDF_TEMPLATE_PATH = "form_template.pdf"
+# /batch-fill requests share one process pool; this many run at once, the rest wait.
+BATCH_FILL_CONCURRENCY = int(os.getenv("BATCH_FILL_CONCURRENCY", "2"))
+batch_pool = SharedPool(PDF_TEMPLATE_PATH, int(os.getenv("BATCH_FILL_WORKERS", "0")) or None)
+batch_slots = asyncio.Semaphore(BATCH_FILL_CONCURRENCY)
+
+_template_loading = None
+
+async def load_template():
+    # Parsed once, in a thread, by whichever gets there first: the warm-up or a request.
+    global _template_loading
+    if _template_loading is None:
+        _template_loading = asyncio.ensure_future(asyncio.to_thread(get_template, PDF_TEMPLATE_PATH))
+    try:
+        return await asyncio.shield(_template_loading)
+    except Exception:
+        _template_loading = None
+        raise
+
+async def warm_up():
+    # In the order a conversation needs them: greeting audio, the STT/LLM client, the
+    # PDF template, then the rest of the fixed lines.
+    start = time.perf_counter()
+    try:
+        await warm_connection("elevenlabs")
+        await prewarm_tts(GREETINGS)
+        await warm_connection("openai")
+        await load_template()
+        print(f"🔥 Warm-up done in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        print("⚠️ Warm-up error:", e)
+    await prewarm_tts(fixed_utterances())
+
+@asynccontextmanager
+async def lifespan(app):
+    # Startup returns at once so uvicorn binds the port straight away; the expensive
+    # pieces warm in the background, and early requests wait only for what they need.
+    app.state.warm_up = asyncio.create_task(warm_up())
+    yield
+    app.state.warm_up.cancel()
+    await close_providers()
+    close_journal()
+    batch_pool.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Allow frontend access
 app.add_middleware(
@@ -35,6 +102,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Endpoints whose stage spans are reported in Server-Timing and request_duration.
+TIMED_ENDPOINTS = frozenset(("/voice-stream", "/voice-stream/events", "/initial-message", "/confirm"))
+
+@app.middleware("http")
+async def record_timing(request: Request, call_next):
+    path = request.url.path
+    if path not in TIMED_ENDPOINTS:
+        return await call_next(request)
+    start = time.perf_counter()
+    spans = start_request()
+    response = await call_next(request)
+    total = time.perf_counter() - start
+    request_duration.observe(total, path)
+    response.headers["Server-Timing"] = server_timing(spans, total)
+    return response
+
+@app.middleware("http")
+async def attach_session(request: Request, call_next):
+    session_id = session_id_from_request(request)
+    is_new = session_id is None
+    if is_new:
+        session_id = new_session_id()
+    request.state.session_id = session_id
+    response = await call_next(request)
+    # Journal what the request changed so any worker can pick the session up next.
+    # Streamed replies save again once their stream finishes.
+    state = getattr(request.state, "session", None)
+    if state is not None:
+        await sessions.save(state)
+    if is_new or request.cookies.get(SESSION_COOKIE) != session_id:
+        response.set_cookie(SESSION_COOKIE, session_id, max_age=SESSION_TTL_SECONDS, httponly=True, samesite="lax")
+    return response
+
+async def get_session(request: Request):
+    state = request.state.session = await sessions.load(request.state.session_id)
+    return state
+
 # Serve static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -42,116 +146,357 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 async def serve_index():
     return FileResponse("templates/index.html")
 
+# Compact response mode, for slow links: audio_url=1 returns an /audio/{key} URL to
+# fetch as raw bytes instead of inline base64, and form_version=N returns only the form
+# fields changed since version N instead of the whole form.
+
+async def audio_fields(audio_bytes, text, audio_url, key_name):
+    if audio_bytes is None:
+        return {key_name: None}
+    if audio_url:
+        key = audio_key(text)
+        # The follow-up GET may land on another worker.
+        await share_audio(key, audio_bytes)
+        return {"audio_url": f"/audio/{key}"}
+    with timed("encode"):
+        return {key_name: base64.b64encode(audio_bytes).decode("utf-8")}
+
+def form_fields(state, form_version, audio_url):
+    # Either knob selects the compact response; without form_version it carries the full
+    # form once, along with the version to send next time.
+    if form_version is None and not audio_url:
+        return {"form_data": state.form_data}
+    return state.form_delta(form_version)
+
 @app.get("/initial-message")
-async def initial_message():
-    assistant_text = get_initial_assistant_message()
+async def initial_message(audio_url: bool = False, form_version: int | None = None, state=Depends(get_session)):
+    assistant_text = get_initial_assistant_message(state)
     try:
-        audio_reply = eleven_client.text_to_speech.convert(
-            voice_id="EXAVITQu4vr4xnSDxMaL",
-            model_id="eleven_monolingual_v1",
-            text=assistant_text
-        )
-        audio_bytes = b"".join(audio_reply)
-        audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
+        audio_bytes = await synthesize(assistant_text, persist=True)
     except Exception as e:
         print("🔊 ElevenLabs audio error:", e)
-        audio_base64 = None
+        fallbacks.inc("text_only_reply")
+        audio_bytes = None
+
+    # incremental_upload tells the client whether to use /voice-stream/chunks.
+    payload = {"assistant_text": assistant_text, "incremental_upload": INCREMENTAL_UPLOADS}
+    payload.update(await audio_fields(audio_bytes, assistant_text, audio_url, "assistant_audio_base64"))
+    if form_version is not None or audio_url:
+        payload.update(form_fields(state, form_version, audio_url))
+    return JSONResponse(payload)
 
-    return JSONResponse({
-        "assistant_text": assistant_text,
-        "assistant_audio_base64": audio_base64
-    })
+async def transcribe_turn(state, audio, utterance, segments):
+    # Either the end of an incremental upload (see /voice-stream/chunks) or uploaded
+    # recordings: one for the whole utterance, or its segments as separate files.
+    if utterance is not None:
+        return await utterances.finish((state.session_id, utterance), segments or 0)
+    if not audio:
+        raise ValueError("No audio uploaded")
+    with timed("upload"):
+        recordings = [(await upload.read(), upload.filename or "recording.webm") for upload in audio]
+    return await transcribe_segments(recordings)
+
+INCOMPLETE_UTTERANCE = {"error": "Incomplete utterance; upload the recorded segments instead"}
+
+@app.post("/voice-stream/chunks")
+async def voice_stream_chunk(request: Request, utterance: str, segment: int, seq: int, last: bool = False):
+    # One timeslice of an utterance segment, as raw bytes, uploaded while the user is
+    # still speaking. The segment is transcribed in the background once its last chunk
+    # is in; the turn itself is then posted with ?utterance=&segments=.
+    if not INCREMENTAL_UPLOADS:
+        return JSONResponse({"error": "Incremental uploads are disabled"}, status_code=404)
+    if not utterance.isalnum() or len(utterance) > 64:
+        return JSONResponse({"error": "Invalid utterance id"}, status_code=400)
+    key = (request.state.session_id, utterance)
+    try:
+        # Refused by its declared size before any of it is read.
+        length = request.headers.get("content-length")
+        if length is not None:
+            utterances.check_size(key, int(length))
+        data = await read_body(request, utterances.max_bytes)
+        utterances.add_chunk(key, segment, seq, data, last)
+    except OverflowError as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except BufferFull as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "1"})
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse({"status": "received"}, status_code=202)
+
+async def read_body(request, limit):
+    body = bytearray()
+    async for part in request.stream():
+        body += part
+        if len(body) > limit:
+            raise OverflowError("chunk too large")
+    return bytes(body)
 
 @app.post("/voice-stream")
-async def voice_stream(audio: UploadFile = File(...)):
-    if end_triggered:
+async def voice_stream(audio: list[UploadFile] = File(None), audio_url: bool = False, form_version: int | None = None,
+                       utterance: str | None = None, segments: int | None = None, state=Depends(get_session)):
+    if state.end_triggered:
+        if utterance is not None:
+            utterances.discard((state.session_id, utterance))
         return JSONResponse({
             "user_text": "",
             "assistant_text": "END OF CONVERSATION",
             "audio_base64": None,
-            "form_data": form_data
+            **form_fields(state, form_version, audio_url)
         })
 
     try:
-        contents = await audio.read()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as temp_audio:
-            temp_audio.write(contents)
-            temp_audio_path = temp_audio.name
-
-        with open(temp_audio_path, "rb") as audio_file:
-            result = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="en",
-                response_format="text",
-                temperature=0.2,
-                prompt="You are transcribing speech for a business form. "
-                       "The user may say business names, postal codes, emails, and names. "
-                       "Avoid guessing – transcribe phonetically when unclear."
-            )
-        user_text = result.strip()
-        print(f"🎤 USER SAID: {user_text}")
-
-        assistant_text = await process_transcribed_text(user_text)
+        user_text = await transcribe_turn(state, audio, utterance, segments)
+
+        form_before = dict(state.form_data)
+        if user_text is None:
+            user_text, assistant_text = "", FALLBACK_REPLY
+        else:
+            assistant_text = await process_transcribed_text(state, user_text)
+        state.commit_form_changes(form_before)
         print(f"🧠 ASSISTANT REPLY: {assistant_text}")
 
         try:
-            audio_reply = eleven_client.text_to_speech.convert(
-                voice_id="EXAVITQu4vr4xnSDxMaL",
-                model_id="eleven_monolingual_v1",
-                text=assistant_text
-            )
-            audio_bytes = b"".join(audio_reply)
-            audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
+            audio_bytes = await synthesize(assistant_text, persist=is_fixed_utterance(assistant_text))
         except Exception as e:
             print("🎧 ElevenLabs speech error:", e)
-            audio_base64 = None
+            fallbacks.inc("text_only_reply")
+            audio_bytes = None
 
         return JSONResponse({
             "user_text": user_text,
             "assistant_text": assistant_text,
-            "audio_base64": audio_base64,
-            "form_data": form_data
+            **await audio_fields(audio_bytes, assistant_text, audio_url, "audio_base64"),
+            **form_fields(state, form_version, audio_url)
         })
 
+    except IncompleteUtterance:
+        return JSONResponse(INCOMPLETE_UTTERANCE, status_code=409)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     except Exception as e:
         print("❌ Error in /voice-stream:", e)
         traceback.print_exc()
         return JSONResponse({"error": str(e)}, status_code=500)
 
+@app.post("/voice-stream/events")
+async def voice_stream_events(audio: list[UploadFile] = File(None), audio_url: bool = False,
+                              form_version: int | None = None, utterance: str | None = None,
+                              segments: int | None = None, state=Depends(get_session)):
+    # Streaming variant of /voice-stream: replies as server-sent events so the first
+    # sentence's audio can play while the rest of the reply is still being generated.
+    if state.end_triggered:
+        if utterance is not None:
+            utterances.discard((state.session_id, utterance))
+        async def ended():
+            yield sse_event("done", {"assistant_text": "END OF CONVERSATION", **form_fields(state, form_version, audio_url)})
+        return StreamingResponse(ended(), media_type="text/event-stream")
+
+    try:
+        user_text = await transcribe_turn(state, audio, utterance, segments)
+    except IncompleteUtterance:
+        return JSONResponse(INCOMPLETE_UTTERANCE, status_code=409)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        print("❌ Error in /voice-stream/events:", e)
+        traceback.print_exc()
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    async def repeat_request():
+        yield FALLBACK_REPLY
+
+    async def events():
+        replies = stream_reply_events(state, user_text, audio_urls=audio_url, form_version=form_version,
+                                      compact=audio_url,
+                                      reply_deltas=repeat_request() if user_text is None else None)
+        try:
+            yield sse_event("user_text", {"text": user_text or ""})
+            async with aclosing(replies):
+                async for event in replies:
+                    yield event
+        finally:
+            # Also when the client left mid-reply: the turn's changes are journaled all the same.
+            await asyncio.shield(sessions.save(state))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def byte_range(range_header, size):
+    # Single "bytes=" ranges only; returns (start, end) inclusive, None for the whole
+    # body, or raises ValueError when the range cannot be satisfied.
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    first, _, last = range_header[6:].strip().partition("-")
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        return None
+    if start > end or start >= size:
+        raise ValueError(range_header)
+    return start, end
+
+@app.get("/audio/{key}")
+async def get_audio(key: str, request: Request):
+    # Synthesized speech by TTS cache key. The key hashes voice, model and text, so the
+    # bytes behind a URL never change.
+    if not key.isalnum():
+        return JSONResponse({"error": "Audio not found"}, status_code=404)
+    audio_bytes = tts_cache.get(key)
+    if audio_bytes is None:
+        audio_bytes = await shared_audio(key)
+    if audio_bytes is None:
+        return JSONResponse({"error": "Audio not found"}, status_code=404)
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "public, max-age=86400, immutable"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    size = len(audio_bytes)
+    try:
+        span = byte_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if span is None:
+        return Response(audio_bytes, media_type="audio/mpeg", headers=headers)
+    start, end = span
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(audio_bytes[start:end + 1], status_code=206, media_type="audio/mpeg", headers=headers)
+
+@app.websocket("/ws/voice")
+async def ws_voice(websocket: WebSocket):
+    # Full-duplex alternative to the HTTP turn loop, relayed to the gpt-4o realtime API.
+    session_id = session_id_from_request(websocket) or new_session_id()
+    await relay_voice(websocket, await sessions.load(session_id))
+
+@app.get("/tts-cache/stats")
+async def tts_cache_stats():
+    return JSONResponse(tts_cache.stats())
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+MAX_SIGNATURE_BYTES = 2 * 1024 * 1024
+
 @app.post("/upload-signature")
-async def upload_signature(request: Request):
+async def upload_signature(request: Request, state=Depends(get_session)):
+    # Takes the image as a multipart "signature" file, or the older JSON data URL.
     try:
-        body = await request.json()
-        image_data = body.get("signature_image", "")
-        if image_data.startswith("data:image/png;base64,"):
-            image_data = image_data.split(",", 1)[1]
-        with open("saved_signature.png", "wb") as f:
-            f.write(base64.b64decode(image_data))
-        print("✅ Signature image saved as saved_signature.png")
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("signature")
+            if upload is None or isinstance(upload, str):
+                return JSONResponse({"error": "Missing signature file"}, status_code=400)
+            image_bytes = await upload.read(MAX_SIGNATURE_BYTES + 1)
+        else:
+            body = await request.json()
+            image_data = body.get("signature_image", "")
+            if image_data.startswith("data:image/png;base64,"):
+                image_data = image_data.split(",", 1)[1]
+            image_bytes = base64.b64decode(image_data)
+        if len(image_bytes) > MAX_SIGNATURE_BYTES:
+            return JSONResponse({"error": "Signature image too large"}, status_code=413)
+
+        box = (await load_template()).signature_box()
+        signature_png = await asyncio.to_thread(normalize_signature, image_bytes, box)
+        state.signature_png = signature_png
+        print(f"✅ Signature saved: {len(image_bytes)} -> {len(signature_png)} bytes")
         return JSONResponse({"status": "signature saved"})
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     except Exception as e:
         print("❌ Signature upload error:", e)
         return JSONResponse({"error": "Failed to save signature"}, status_code=500)
 
+async def render_artifact(key, data, signature_png):
+    # No render at all when the same data and signature were filled before.
+    template = await load_template()
+    with timed("pdf_render"):
+        return await artifact_store.get_or_render(key, lambda: template.render(data, signature_png))
+
 @app.post("/confirm")
-async def confirm(request: Request):
+async def confirm(request: Request, state=Depends(get_session)):
     try:
         body = await request.json()
         if body.get("confirmed"):
-            edited_data = body.get("form_data", {})
-            fill_pdf("form_template.pdf", "filled_form.pdf", edited_data)
-            return JSONResponse({"status": "filled"})
+            edited_data = normalize_form_data(body.get("form_data") or state.form_data)
+            signature_png = state.signature_png
+            key = artifact_key((await load_template()).digest, edited_data, signature_png)
+            await render_artifact(key, edited_data, signature_png)
+            state.artifact_key = key
+            state.artifact_inputs = (edited_data, signature_png)
+            print(f"✅ PDF ready for session {state.session_id}: {key}")
+            return JSONResponse({"status": "filled", "download_url": f"/download/{key}"})
         return JSONResponse({"status": "not confirmed"}, status_code=400)
     except Exception as e:
         print("❌ Error in /confirm:", e)
         return JSONResponse({"error": str(e)}, status_code=500)
 
+async def serve_artifact(request, state, key, cache_control):
+    # Artifacts are only served to the session that confirmed them.
+    if key is None or key != state.artifact_key:
+        return JSONResponse({"error": "No filled form for this session"}, status_code=404)
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    pdf_bytes = await render_artifact(key, *state.artifact_inputs)
+    headers["Content-Disposition"] = 'attachment; filename="MerchantForm.pdf"'
+    return Response(pdf_bytes, media_type="application/pdf", headers=headers)
+
 @app.get("/download")
-async def download_pdf():
-    return FileResponse("filled_form.pdf", media_type="application/pdf", filename="MerchantForm.pdf")
+async def download_pdf(request: Request, state=Depends(get_session)):
+    # Always the session's latest form, so clients must revalidate; the ETag makes that cheap.
+    return await serve_artifact(request, state, state.artifact_key, "private, no-cache")
+
+@app.get("/download/{key}")
+async def download_artifact(key: str, request: Request, state=Depends(get_session)):
+    # Content-addressed, so the bytes behind this URL never change.
+    return await serve_artifact(request, state, key, "private, max-age=86400, immutable")
+
+@app.post("/batch-fill")
+async def batch_fill(request: Request):
+    # Renders a JSON list of records across the shared process pool and returns a zip of
+    # PDFs plus errors.jsonl. The archive is spooled to disk so memory stays bounded.
+    try:
+        records = await request.json()
+        if not isinstance(records, list):
+            return JSONResponse({"error": "Expected a JSON list of records"}, status_code=400)
+
+        async with batch_slots:
+            pool = batch_pool.get()
+            fd, zip_path = tempfile.mkstemp(suffix=".zip")
+
+            def build_zip():
+                with os.fdopen(fd, "wb") as archive:
+                    return write_to_zip(render_batch(records, workers=batch_pool.workers, pool=pool), archive)
+
+            try:
+                summary = await asyncio.to_thread(build_zip)
+            except BaseException as e:
+                # Also on cancellation: the thread may still be writing, but the file is gone.
+                os.remove(zip_path)
+                if isinstance(e, BrokenProcessPool):
+                    batch_pool.discard(pool)
+                raise
+        print(f"✅ Batch fill: {summary['rendered']} rendered, {summary['failed']} failed")
+        return FileResponse(
+            zip_path,
+            media_type="application/zip",
+            filename="MerchantForms.zip",
+            headers={"X-Batch-Rendered": str(summary["rendered"]), "X-Batch-Failed": str(summary["failed"])},
+            background=BackgroundTask(os.remove, zip_path)
+        )
+    except Exception as e:
+        print("❌ Error in /batch-fill:", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
 
 @app.post("/reset")
-async def reset():
-    reset_assistant_state()
+async def reset(state=Depends(get_session)):
+    reset_assistant_state(state)
     return JSONResponse({"status": "reset successful"})
@@ -0,0 +1,152 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Hand-rolled Prometheus text exposition. Observing is a bisect and two additions
+# under a lock; nothing is formatted until /metrics is scraped.
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum, count. Made cumulative on render.
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for labels, value in snapshot:
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+stage_duration = Histogram(
+    "voice_stage_duration_seconds", "Time spent in each stage of a request.", ("stage",)
+)
+request_duration = Histogram(
+    "voice_request_duration_seconds", "Time to response headers per endpoint.", ("endpoint",)
+)
+provider_errors = Counter(
+    "voice_provider_errors_total", "Failed or timed out provider calls.", ("stage",)
+)
+fallbacks = Counter(
+    "voice_fallbacks_total", "Times a degraded result was used instead of failing.", ("kind",)
+)
+provider_retries = Counter(
+    "voice_provider_retries_total", "Provider calls retried after a transient error.", ("stage",)
+)
+provider_hedges = Counter(
+    "voice_provider_hedges_total", "Duplicate provider requests sent after the p95 threshold.", ("stage",)
+)
+circuit_opens = Counter(
+    "voice_provider_circuit_opens_total", "Times a provider circuit breaker opened.", ("stage",)
+)
+pdf_artifact_requests = Counter(
+    "voice_pdf_artifact_requests_total", "Filled-PDF lookups by outcome (hit, shared, render).", ("result",)
+)
+
+REGISTRY = (
+    stage_duration, request_duration, provider_errors, provider_retries, provider_hedges,
+    circuit_opens, fallbacks, pdf_artifact_requests,
+)
+
+# Spans recorded while handling the current request, for the Server-Timing header.
+# None outside a request, in which case only the histograms are updated.
+_request_spans = ContextVar("request_spans", default=None)
+
+
+def start_request():
+    spans = []
+    _request_spans.set(spans)
+    return spans
+
+
+def record_span(stage, seconds):
+    stage_duration.observe(seconds, stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    # Wraps awaits as well as blocking code; the span is recorded even if the stage raises.
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+
+def server_timing(spans, total=None):
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in spans]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,90 @@
+import os
+import json
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from metrics import pdf_artifact_requests
+
+# Filled PDFs are addressed by a hash of the template, the normalized form data and
+# the signature, so identical input is rendered once and then served from memory.
+PDF_ARTIFACT_CACHE_BYTES = int(os.getenv("PDF_ARTIFACT_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+
+def normalize_form_data(data):
+    # Empty values render as nothing, so they must not change the key either.
+    normalized = {}
+    for key, value in data.items():
+        if value is None or value == "null":
+            continue
+        value = str(value).strip()
+        if value:
+            normalized[key] = value
+    return normalized
+
+
+def artifact_key(template_digest, data, signature_png=None):
+    digest = hashlib.sha256()
+    digest.update(template_digest.encode())
+    digest.update(json.dumps(data, sort_keys=True, ensure_ascii=False).encode())
+    digest.update(b"\0")
+    digest.update(hashlib.sha256(signature_png).digest() if signature_png else b"unsigned")
+    return digest.hexdigest()[:32]
+
+
+class ArtifactStore:
+    # LRU bounded by total bytes; the most recently used artifact sits at the end.
+    def __init__(self, max_bytes=PDF_ARTIFACT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._artifacts = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._artifacts
+
+    def get(self, key):
+        with self._lock:
+            pdf_bytes = self._artifacts.get(key)
+            if pdf_bytes is not None:
+                self._artifacts.move_to_end(key)
+        return pdf_bytes
+
+    def put(self, key, pdf_bytes):
+        with self._lock:
+            old = self._artifacts.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old)
+            self._artifacts[key] = pdf_bytes
+            self.total_bytes += len(pdf_bytes)
+            while self.total_bytes > self.max_bytes and len(self._artifacts) > 1:
+                _, evicted = self._artifacts.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    async def get_or_render(self, key, render):
+        # render is a blocking callable returning PDF bytes; it runs in a thread, and
+        # concurrent requests for the same key share one render.
+        pdf_bytes = self.get(key)
+        if pdf_bytes is not None:
+            pdf_artifact_requests.inc("hit")
+            return pdf_bytes
+        pending = self._inflight.get(key)
+        if pending is not None:
+            pdf_artifact_requests.inc("shared")
+            return await asyncio.shield(pending)
+
+        pdf_artifact_requests.inc("render")
+        pending = self._inflight[key] = asyncio.ensure_future(asyncio.to_thread(render))
+        try:
+            pdf_bytes = await asyncio.shield(pending)
+        finally:
+            self._inflight.pop(key, None)
+        self.put(key, pdf_bytes)
+        return pdf_bytes
+
+    def stats(self):
+        return {"artifacts": len(self._artifacts), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+
+
+artifact_store = ArtifactStore()
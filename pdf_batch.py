@@ -0,0 +1,167 @@
+import os
+import re
+import sys
+import json
+import zipfile
+import argparse
+import threading
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from fill_pdf_logic import get_template
+
+# A record is a JSON object of form fields. An optional "_id" names the output file;
+# otherwise records are named by their position in the batch.
+BatchResult = namedtuple("BatchResult", "index name pdf_bytes error")
+
+# Fixed zip entry timestamp so identical input produces an identical archive.
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+_template = None
+
+
+def _init_worker(template_path):
+    global _template
+    _template = get_template(template_path)
+
+
+def record_name(index, record):
+    record_id = record.get("_id") if isinstance(record, dict) else None
+    if record_id is None:
+        return f"record-{index:06d}"
+    return f"{index:06d}-" + re.sub(r"[^A-Za-z0-9._-]+", "_", str(record_id))[:80]
+
+
+def _render_record(index, record):
+    # JSONL lines arrive unparsed so that parsing also happens in the workers.
+    try:
+        if isinstance(record, str):
+            record = json.loads(record)
+        if not isinstance(record, dict):
+            raise ValueError("record must be a JSON object")
+        name = record_name(index, record)
+        data = {key: value for key, value in record.items() if not key.startswith("_")}
+        return BatchResult(index, name, _template.render(data), None)
+    except Exception as e:
+        return BatchResult(index, record_name(index, record), None, f"{type(e).__name__}: {e}")
+
+
+def open_pool(template_path="form_template.pdf", workers=None):
+    # Each worker parses the template once, when it starts.
+    return ProcessPoolExecutor(workers or os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(template_path,))
+
+
+def render_batch(records, template_path="form_template.pdf", workers=None, window=None, pool=None):
+    # Yields results in input order. At most `window` records are in flight, so memory
+    # stays bounded no matter how long the input is. A given pool is left running.
+    workers = workers or os.cpu_count() or 1
+    window = window or workers * 4
+    if pool is None:
+        with open_pool(template_path, workers) as pool:
+            yield from render_batch(records, template_path, workers, window, pool)
+        return
+    pending = deque()
+    try:
+        for index, record in enumerate(records):
+            pending.append(pool.submit(_render_record, index, record))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Abandoned early (an error, or the caller stopped reading): free the pool.
+        for future in pending:
+            future.cancel()
+
+
+class SharedPool:
+    # One process pool for every batch request in this server, started on first use
+    # and replaced if a worker dies.
+    def __init__(self, template_path, workers=None):
+        self.template_path = template_path
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = open_pool(self.template_path, self.workers)
+            return self._pool
+
+    def discard(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def read_jsonl(path):
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def _error_line(result):
+    return json.dumps({"index": result.index, "name": result.name, "error": result.error}) + "\n"
+
+
+def write_to_directory(results, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    summary = {"rendered": 0, "failed": 0}
+    with open(os.path.join(out_dir, "errors.jsonl"), "w") as errors:
+        for result in results:
+            if result.error:
+                summary["failed"] += 1
+                errors.write(_error_line(result))
+                continue
+            with open(os.path.join(out_dir, result.name + ".pdf"), "wb") as f:
+                f.write(result.pdf_bytes)
+            summary["rendered"] += 1
+    return summary
+
+
+def write_to_zip(results, fileobj):
+    summary = {"rendered": 0, "failed": 0}
+    error_lines = []
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_STORED) as archive:
+        for result in results:
+            if result.error:
+                summary["failed"] += 1
+                error_lines.append(_error_line(result))
+                continue
+            # PDFs are already deflated; storing them keeps the archive cheap to write.
+            archive.writestr(zipfile.ZipInfo(result.name + ".pdf", ZIP_DATE_TIME), result.pdf_bytes)
+            summary["rendered"] += 1
+        archive.writestr(zipfile.ZipInfo("errors.jsonl", ZIP_DATE_TIME), "".join(error_lines))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill many merchant applications from a JSONL file.")
+    parser.add_argument("input_pdf_path")
+    parser.add_argument("jsonl_path")
+    parser.add_argument("output", help="output directory, or a path ending in .zip")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    results = render_batch(read_jsonl(args.jsonl_path), args.input_pdf_path, args.workers)
+    if args.output.endswith(".zip"):
+        with open(args.output, "wb") as f:
+            summary = write_to_zip(results, f)
+    else:
+        summary = write_to_directory(results, args.output)
+    print(f"✅ Batch done: {summary['rendered']} rendered, {summary['failed']} failed -> {args.output}")
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import os
+import re
+import math
+
+try:
+    import tiktoken
+except ImportError:  # optional; fall back to an estimate
+    tiktoken = None
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "900"))
+MAX_RECENT_TURNS = int(os.getenv("CONTEXT_MAX_RECENT_TURNS", "6"))
+
+FIELD_LABELS = {
+    "SiteCompanyName1": "DBA name", "SiteAddress": "business address", "SiteCity": "business city",
+    "SiteState": "business state", "SiteZip": "business zip", "SiteVoice": "business phone",
+    "SiteFax": "business fax", "CorporateCompanyName1": "legal corporate name",
+    "CorporateAddress": "billing address", "CorporateCity": "billing city",
+    "CorporateState": "billing state", "CorporateZip": "billing zip", "CorporateName": "contact name",
+    "SiteEmail": "business email", "CorporateVoice": "contact phone", "CorporateFax": "contact fax",
+    "BusinessWebsite": "website", "CorporateEmail": "contact email",
+    "CustomerSvcEmail": "customer service email", "AppRetrievalMail": "retrieval requests by mail",
+    "AppRetrievalFax": "retrieval requests by fax", "AppRetrievalFaxNumber": "retrieval fax number",
+    "MCC-Desc": "MCC/SIC description", "MerchantInitials": "initials",
+    "MerchantSignatureName": "signature name",
+}
+
+_WORD_PIECES = re.compile(r"[A-Za-z]+|\d|[^\sA-Za-z\d]")
+_encoding = None
+
+
+def count_tokens(text):
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        return len(_encoding.encode(text))
+    # Roughly one token per four letters of a word, plus one per digit or symbol.
+    return sum(math.ceil(len(piece) / 4) for piece in _WORD_PIECES.findall(text))
+
+
+def message_tokens(message):
+    # Each chat message carries a few tokens of framing on top of its content.
+    return count_tokens(message["content"]) + 4
+
+
+def build_state_block(form_data):
+    collected = "; ".join(f"{FIELD_LABELS.get(k, k)}={v}" for k, v in form_data.items() if v is not None)
+    missing = ", ".join(FIELD_LABELS.get(k, k) for k, v in form_data.items() if v is None)
+    return (
+        "Form state; never ask again for collected fields.\n"
+        f"Collected: {collected or 'none'}\n"
+        f"Missing: {missing or 'none'}"
+    )
+
+
+class ContextBuilder:
+    # Message layout: [stable system prompt] [form state block] [recent turns].
+    # The first message is byte-identical for every turn and session, so upstream
+    # prompt caching can reuse it. Older turns are dropped rather than resent; the
+    # state block carries what they established.
+    def __init__(self, system_prompt, token_budget=CONTEXT_TOKEN_BUDGET, max_recent_turns=MAX_RECENT_TURNS):
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.system_tokens = message_tokens(self.system_message)
+        self.token_budget = token_budget
+        self.max_recent_turns = max_recent_turns
+
+    def build(self, form_data, history):
+        state_message = {"role": "system", "content": build_state_block(form_data)}
+        remaining = self.token_budget - self.system_tokens - message_tokens(state_message)
+
+        recent = []
+        for msg in reversed(history[-self.max_recent_turns:]):
+            message = {"role": msg["role"], "content": msg["text"]}
+            cost = message_tokens(message)
+            if cost > remaining and recent:
+                break
+            recent.append(message)
+            remaining -= cost
+        recent.reverse()
+        return [self.system_message, state_message] + recent
+
+
+def prompt_tokens(messages):
+    return sum(message_tokens(message) for message in messages)
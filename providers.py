@@ -0,0 +1,215 @@
+import os
+import asyncio
+import threading
+from dotenv import load_dotenv
+from tts_cache import tts_cache, cache_key
+from metrics import timed, provider_errors
+from resilience import StageGuard, CircuitOpenError, is_retryable
+
+load_dotenv()
+
+VOICE_ID = "EXAVITQu4vr4xnSDxMaL"
+TTS_MODEL_ID = "eleven_monolingual_v1"
+
+STT_PROMPT = (
+    "You are transcribing speech for a business form. "
+    "The user may say business names, postal codes, emails, and names. "
+    "Avoid guessing – transcribe phonetically when unclear."
+)
+
+# Per-stage deadlines (seconds) and the number of in-flight calls allowed per provider.
+STAGE_TIMEOUTS = {
+    "stt": float(os.getenv("STT_TIMEOUT_SECONDS", "20")),
+    "llm": float(os.getenv("LLM_TIMEOUT_SECONDS", "30")),
+    "tts": float(os.getenv("TTS_TIMEOUT_SECONDS", "20")),
+}
+PROVIDER_CONCURRENCY = int(os.getenv("PROVIDER_CONCURRENCY", "64"))
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1"
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL") or "https://api.elevenlabs.io"
+
+# The SDKs take about a second to import, so clients are built on first use (or by
+# the warm-up after the port is bound) rather than when this module is imported.
+_clients = {}
+_clients_lock = threading.RLock()
+
+
+def _client(name, build):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = build()
+    return client
+
+
+def http_client():
+    # One pooled connection set shared by every provider client in this worker.
+    def build():
+        import httpx
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=PROVIDER_CONCURRENCY * 2,
+                max_keepalive_connections=PROVIDER_CONCURRENCY,
+                keepalive_expiry=60,
+            ),
+            timeout=httpx.Timeout(max(STAGE_TIMEOUTS.values()), connect=5.0),
+        )
+    return _client("http", build)
+
+
+def openai_client():
+    def build():
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=OPENAI_BASE_URL,
+            http_client=http_client(),
+            max_retries=0,
+        )
+    return _client("openai", build)
+
+
+def eleven_client():
+    def build():
+        from elevenlabs.client import AsyncElevenLabs
+        return AsyncElevenLabs(
+            api_key=os.getenv("ELEVENLABS_API_KEY"),
+            base_url=ELEVENLABS_BASE_URL,
+            httpx_client=http_client(),
+        )
+    return _client("eleven", build)
+
+_limits = {stage: asyncio.Semaphore(PROVIDER_CONCURRENCY) for stage in STAGE_TIMEOUTS}
+guards = {stage: StageGuard(stage, timeout) for stage, timeout in STAGE_TIMEOUTS.items()}
+
+
+async def run_stage(stage, make_call, hedge=True, kind=None):
+    # make_call returns a new coroutine per attempt, so the guard can retry and hedge;
+    # kind picks the latency window the hedge delay is taken from.
+    async with _limits[stage]:
+        try:
+            return await guards[stage].call(make_call, hedge=hedge, kind=kind)
+        except Exception:
+            provider_errors.inc(stage)
+            raise
+
+
+async def transcribe(audio_file):
+    with timed("stt"):
+        result = await run_stage("stt", lambda: openai_client().audio.transcriptions.create(
+            model="whisper-1",
+            file=audio_file,
+            language="en",
+            response_format="text",
+            temperature=0.2,
+            prompt=STT_PROMPT
+        ))
+    return result.strip()
+
+
+async def chat_completion(**kwargs):
+    # A hedged stream would leave the losing response open, so streams are only retried.
+    # Only the time to open a stream is measured, so streams keep a window of their own.
+    stream = bool(kwargs.get("stream"))
+    return await run_stage(
+        "llm", lambda: openai_client().chat.completions.create(**kwargs), hedge=not stream,
+        kind=(kwargs.get("model"), "stream" if stream else "buffered")
+    )
+
+
+async def _collect_audio(text):
+    chunks = []
+    async for chunk in eleven_client().text_to_speech.convert(
+        VOICE_ID,
+        model_id=TTS_MODEL_ID,
+        text=text
+    ):
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def audio_key(text):
+    return cache_key(VOICE_ID, TTS_MODEL_ID, text)
+
+
+def cached_audio(text):
+    return tts_cache.get(audio_key(text))
+
+
+async def synthesize(text, persist=False):
+    # persist=True also keeps the audio in the on-disk tier, for fixed utterances.
+    key = audio_key(text)
+    audio = tts_cache.get(key)
+    if audio is None:
+        with timed("tts"):
+            audio = await run_stage("tts", lambda: _collect_audio(text))
+        tts_cache.put(key, audio, persist=persist)
+    return audio
+
+
+async def prewarm_tts(texts, concurrency=4):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def warm(text):
+        if tts_cache.contains(cache_key(VOICE_ID, TTS_MODEL_ID, text)):
+            return
+        async with limit:
+            try:
+                await synthesize(text, persist=True)
+            except Exception as e:
+                print("⚠️ TTS prewarm error:", e)
+
+    await asyncio.gather(*(warm(text) for text in texts))
+    print(f"🔥 TTS cache warm: {tts_cache.stats()}")
+
+
+async def synthesize_stream(text):
+    # Yields audio chunks as ElevenLabs produces them; the stage timeout bounds each chunk.
+    # Not retried once audio has started, but it shares the TTS circuit breaker.
+    breaker = guards["tts"].breaker
+    if not breaker.allow():
+        provider_errors.inc("tts")
+        raise CircuitOpenError("tts")
+    async with _limits["tts"]:
+        chunks = eleven_client().text_to_speech.stream(
+            VOICE_ID,
+            model_id=TTS_MODEL_ID,
+            text=text
+        ).__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), STAGE_TIMEOUTS["tts"])
+            except StopAsyncIteration:
+                breaker.record_success()
+                return
+            except Exception as e:
+                provider_errors.inc("tts")
+                # As in StageGuard.call, a client error does not count against the provider.
+                if is_retryable(e):
+                    breaker.record_failure()
+                raise
+            if chunk:
+                yield chunk
+
+
+async def warm_connection(provider):
+    # Builds the client off the event loop, then opens a pooled connection (DNS, TCP
+    # and TLS) so the first real call does not pay for the handshake.
+    build, url = {
+        "openai": (openai_client, OPENAI_BASE_URL),
+        "elevenlabs": (eleven_client, ELEVENLABS_BASE_URL),
+    }[provider]
+    await asyncio.to_thread(build)
+    try:
+        await http_client().head(url, timeout=5.0)
+    except Exception as e:
+        print(f"⚠️ Connection warm-up failed for {provider}:", e)
+
+
+async def aclose():
+    client = _clients.pop("http", None)
+    _clients.clear()
+    if client is not None:
+        await client.aclose()
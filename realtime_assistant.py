@@ -1,60 +1,94 @@
-import json
 import os
+import re
+import json
 import random
-from datetime import datetime
-from openai import OpenAI
-from dotenv import load_dotenv
-
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-form_data = {
-    "SiteCompanyName1": None, "SiteAddress": None, "SiteCity": None, "SiteState": None, "SiteZip": None,
-    "SiteVoice": None, "SiteFax": None, "CorporateCompanyName1": None, "CorporateAddress": None,
-    "CorporateCity": None, "CorporateState": None, "CorporateZip": None, "CorporateName": None,
-    "SiteEmail": None, "CorporateVoice": None, "CorporateFax": None, "BusinessWebsite": None,
-    "CorporateEmail": None, "CustomerSvcEmail": None, "AppRetrievalMail": None, "AppRetrievalFax": None,
-    "AppRetrievalFaxNumber": None, "MCC-Desc": None,
-
-    # Simplified: use one initials and one signature field
-    "MerchantInitials": None,
-    "MerchantSignatureName": None
-}
+import asyncio
+from providers import chat_completion
+from field_extractors import fast_extract, merge_extractions, asked_fields
+from prompt_context import ContextBuilder, FIELD_LABELS
+from session_store import FORM_FIELDS
+from metrics import timed, fallbacks
+
+INSTRUCTION_PROMPT = """
+You are a conversational AI assistant helping users fill out a Merchant Processing Application.
+
+Be intelligent, friendly, and natural—like Siri or ChatGPT. Guide the user through collecting the following fields only:
 
-conversation_history = []
-last_assistant_msg = ""
-end_triggered = False
-summary_given = False
-summary_confirmed = False
-pending_confirmation = None
+- DBAName
+- LegalCorporateName
+- BusinessAddress
+- BillingAddress
+- City
+- State
+- Zip
+- Phone
+- Fax
+- ContactName
+- BusinessEmail
+- ContactPhone
+- ContactFax
+- ContactEmail
+- Website
+- CustomerServiceEmail
+- RetrievalRequestDestination
+- MCCSICDescription
+
+Ask one or two natural, context-aware questions at a time. Provide gentle examples if needed. Avoid robotic phrasing.
+Always prioritize privacy and remind the user not to share sensitive information unless necessary for the form. For sections requiring specific types of data like percentages, business types, or legal requirements, 
+offer examples to aid in understanding.ONLY If the transcription is unclear or seems misspelled, spell it back to the user and ask for confirmation before moving on.NEVER include external links, promotional messages, or teaching tips.
+Once all these fields are collected, read back the entire collected information to the user and ask them to confirm it and mention that it may take a few seconds to process all the information.
+After they confirm, ask for initials and/or draw signature after conversation if missing. Then respond with 'END OF CONVERSATION' and nothing else.
+
+DO NOT REPEAT THE SUMMARY. DO NOT REPEAT END OF CONVERSATION.
+"""
+
+GREETINGS = [
+    "Hi there! Ready to fill out your Merchant Application? Let's get started — what's your DBA or business name?",
+    "Hello! I’ll be helping you fill out your merchant form. Let’s begin with your business’s DBA name.",
+    "Welcome! Let’s kick things off. What’s the name your business operates under (DBA)?",
+    "Hey! I’ll guide you through your Merchant form. First, can you tell me your DBA or business name?",
+    "Great to have you! To start, what’s the doing-business-as (DBA) name for your company?"
+]
+SIGNATURE_PROMPT = "Thanks! One last thing before we wrap up — could you give me your initials and your full name for the signature?"
+CLARIFICATION_TEMPLATE = "Got it — let's try again. What should I note down for {field}?"
+dialogue_context = ContextBuilder(INSTRUCTION_PROMPT)
+
+# How a turn's extraction and dialogue calls are scheduled: "sequential" (extract, then
+# reply), "speculative" (both at once) or "merged" (one structured-output call).
+TURN_MODE = os.getenv("ASSISTANT_TURN_MODE", "sequential")
+
+FALLBACK_REPLY = "Sorry, could you please repeat that?"
+# Degraded mode: asked from a template when gpt-4o is unavailable, so the form keeps moving.
+NEXT_FIELD_TEMPLATE = "Thanks! Next, what is the {label}?"
+END_OF_CONVERSATION = "END OF CONVERSATION"
 
 CONFIRMATION_FIELDS = [
     "SiteCompanyName1", "CorporateCompanyName1", "CorporateName",
     "SiteEmail", "CorporateEmail", "CustomerSvcEmail",
     "SiteZip", "CorporateZip"
 ]
+# Filled at the signature step, so never asked for one at a time.
+SIGNATURE_FIELDS = ("MerchantInitials", "MerchantSignatureName")
 
-def get_initial_assistant_message():
-    global last_assistant_msg
-    greetings = [
-        "Hi there! Ready to fill out your Merchant Application? Let's get started — what's your DBA or business name?",
-        "Hello! I’ll be helping you fill out your merchant form. Let’s begin with your business’s DBA name.",
-        "Welcome! Let’s kick things off. What’s the name your business operates under (DBA)?",
-        "Hey! I’ll guide you through your Merchant form. First, can you tell me your DBA or business name?",
-        "Great to have you! To start, what’s the doing-business-as (DBA) name for your company?"
-    ]
-    initial_message = random.choice(greetings)
-    last_assistant_msg = initial_message
-    conversation_history.append({
-        "role": "assistant",
-        "text": initial_message,
-        "timestamp": datetime.now().isoformat()
-    })
+def fixed_utterances():
+    # Every assistant line that does not come from the model, for TTS pre-warming: only
+    # confirmation fields get a clarification, and degraded_reply never asks the signature.
+    clarifications = [CLARIFICATION_TEMPLATE.format(field=field) for field in CONFIRMATION_FIELDS]
+    next_fields = [next_field_question(field) for field in FORM_FIELDS if field not in SIGNATURE_FIELDS]
+    return GREETINGS + [SIGNATURE_PROMPT, FALLBACK_REPLY, END_OF_CONVERSATION] + clarifications + next_fields
+
+def is_fixed_utterance(text):
+    return text in _FIXED_UTTERANCES
+
+def get_initial_assistant_message(state):
+    initial_message = random.choice(GREETINGS)
+    state.last_assistant_msg = initial_message
+    state.append_turn("assistant", initial_message)
     return initial_message
 
-def build_summary_from_form():
+def build_summary_from_form(state):
     summary_lines = []
-    for field, value in form_data.items():
+    for field, value in state.form_data.items():
         if value:
             name = field.replace("MCC-Desc", "MCC SIC Description").replace("CustomerSvcEmail", "Customer Service Email")
             name = name.replace("SiteCompanyName1", "DBA Name").replace("CorporateCompanyName1", "Legal Corporate Name")
@@ -67,144 +101,336 @@ def build_summary_from_form():
     summary += "\n\nPlease confirm if all the details are correct. Once confirmed, it may take a few seconds to process."
     return summary
 
-async def process_transcribed_text(user_text):
-    global last_assistant_msg, end_triggered, summary_given, summary_confirmed, pending_confirmation
+def add_assistant_turn(state, text):
+    state.last_assistant_msg = text
+    state.append_turn("assistant", text)
+    return text
 
-    conversation_history.append({
-        "role": "user",
-        "text": user_text,
-        "timestamp": datetime.now().isoformat()
-    })
+def begin_user_turn(state, user_text):
+    # Records the user turn and resolves a pending confirmation. Returns the
+    # clarification prompt when the user did not confirm, otherwise None.
+    state.append_turn("user", user_text)
 
-    if pending_confirmation:
+    if state.pending_confirmation:
         if any(kw in user_text.lower() for kw in ["yes", "correct", "confirmed", "that’s right"]):
-            form_data[pending_confirmation[0]] = pending_confirmation[1]
-            pending_confirmation = None
+            state.form_data[state.pending_confirmation[0]] = state.pending_confirmation[1]
+            state.pending_confirmation = None
         else:
-            clarification = f"Got it — let's try again. What should I note down for {pending_confirmation[0]}?"
-            last_assistant_msg = clarification
-            conversation_history.append({"role": "assistant", "text": clarification, "timestamp": datetime.now().isoformat()})
-            return clarification
+            return add_assistant_turn(state, CLARIFICATION_TEMPLATE.format(field=state.pending_confirmation[0]))
+    return None
 
-    extraction_prompt = f"""
-You are helping fill out a Merchant Processing Application. Based on the assistant's last question and the user's reply, extract any relevant fields from this list:
+EXTRACTION_SYSTEM_PROMPT = """You extract structured form fields with confidence.
 
-{list(form_data.keys())}
-
-Assistant: {last_assistant_msg}
-User: {user_text}
+You are helping fill out a Merchant Processing Application. Based on the assistant's last question and the user's reply, extract any relevant fields from the list you are given.
 
 Return only a JSON object using those exact field names. If unsure or likely to be wrong, still include it and indicate the confidence level like this:
-{{ "SiteCompanyName1": {{"value": "Jane’s Burgers", "confidence": 0.6 }} }}
+{ "SiteCompanyName1": {"value": "Jane’s Burgers", "confidence": 0.6 } }
 
-If nothing applies, return {{}}.
-"""
+If nothing applies, return {}."""
+
+def build_extraction_prompt(state, user_text):
+    # Only fields that are still empty can be filled, so only those are listed.
+    missing = [field for field, value in state.form_data.items() if value is None]
+    return f"""Fields: {missing}
+
+Assistant: {state.last_assistant_msg}
+User: {user_text}"""
+
+async def extract_fields(state, user_text):
+    # Rule-based extractors go first; when they answer everything the last question
+    # asked for, the gpt-4 call is skipped.
+    with timed("fast_extract"):
+        local = fast_extract(state.last_assistant_msg, user_text)
+    if local.answered:
+        return local.fields
+    return merge_extractions(await _llm_extract_fields(state, user_text), local.fields)
+
+async def _llm_extract_fields(state, user_text):
     try:
-        extract_response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You extract structured form fields with confidence."},
-                {"role": "user", "content": extraction_prompt}
-            ],
-            temperature=0.3
-        )
+        with timed("extract"):
+            extract_response = await chat_completion(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+                    {"role": "user", "content": build_extraction_prompt(state, user_text)}
+                ],
+                temperature=0.3
+            )
         extracted_json = json.loads(extract_response.choices[0].message.content.strip())
+        return extracted_json if isinstance(extracted_json, dict) else {}
+    except Exception as e:
+        print("⚠️ Field extraction error:", e)
+        fallbacks.inc("extraction_skipped")
+        return {}
+
+def finish_user_turn(state, user_text, extracted_json):
+    # Applies extracted fields and decides whether the turn needs a fixed reply
+    # (confirmation, signature prompt or end of conversation) instead of gpt-4o.
+    form_data = state.form_data
+    try:
         for key, val in extracted_json.items():
             if key in form_data and form_data[key] is None:
                 if isinstance(val, dict) and "value" in val:
                     if key in CONFIRMATION_FIELDS and val.get("confidence", 1) < 0.9:
                         guess = val["value"]
-                        prompt = f"You said: {guess}. Did I get that right for {key}?"
-                        pending_confirmation = (key, guess)
-                        last_assistant_msg = prompt
-                        conversation_history.append({"role": "assistant", "text": prompt, "timestamp": datetime.now().isoformat()})
-                        return prompt
+                        state.pending_confirmation = (key, guess)
+                        return add_assistant_turn(state, f"You said: {guess}. Did I get that right for {key}?")
                     form_data[key] = val["value"]
                 else:
                     form_data[key] = val
     except Exception as e:
         print("⚠️ Field extraction error:", e)
 
-    core_fields = [k for k in form_data if k not in ("MerchantInitials", "MerchantSignatureName")]
+    core_fields = [k for k in form_data if k not in SIGNATURE_FIELDS]
     all_core_fields_filled = all(form_data[k] is not None for k in core_fields)
 
-    if all_core_fields_filled and not summary_given:
-        summary_given = True
-        prompt = "Thanks! One last thing before we wrap up — could you give me your initials and your full name for the signature?"
-        last_assistant_msg = prompt
-        conversation_history.append({"role": "assistant", "text": prompt, "timestamp": datetime.now().isoformat()})
-        return prompt
+    if all_core_fields_filled and not state.summary_given:
+        state.summary_given = True
+        return add_assistant_turn(state, SIGNATURE_PROMPT)
 
-    if summary_given and not summary_confirmed:
+    if state.summary_given and not state.summary_confirmed:
         if any(phrase in user_text.lower() for phrase in ["yes", "correct", "confirmed", "looks good", "all good"]):
-            summary_confirmed = True
-            end_triggered = True
-            final_msg = "END OF CONVERSATION"
-            last_assistant_msg = final_msg
-            conversation_history.append({"role": "assistant", "text": final_msg, "timestamp": datetime.now().isoformat()})
-            return final_msg
-
-    instruction_prompt = """
-You are a conversational AI assistant helping users fill out a Merchant Processing Application.
+            state.summary_confirmed = True
+            state.end_triggered = True
+            return add_assistant_turn(state, END_OF_CONVERSATION)
 
-Be intelligent, friendly, and natural—like Siri or ChatGPT. Guide the user through collecting the following fields only:
+    return None
 
-- DBAName
-- LegalCorporateName
-- BusinessAddress
-- BillingAddress
-- City
-- State
-- Zip
-- Phone
-- Fax
-- ContactName
-- BusinessEmail
-- ContactPhone
-- ContactFax
-- ContactEmail
-- Website
-- CustomerServiceEmail
-- RetrievalRequestDestination
-- MCCSICDescription
+async def handle_user_turn(state, user_text):
+    # Records the user turn and runs field extraction. Returns a fixed reply when
+    # no gpt-4o call is needed, otherwise None.
+    fixed_reply = begin_user_turn(state, user_text)
+    if fixed_reply is not None:
+        return fixed_reply
+    extracted_json = await extract_fields(state, user_text)
+    return finish_user_turn(state, user_text, extracted_json)
 
-Ask one or two natural, context-aware questions at a time. Provide gentle examples if needed. Avoid robotic phrasing.
-Always prioritize privacy and remind the user not to share sensitive information unless necessary for the form. For sections requiring specific types of data like percentages, business types, or legal requirements, 
-offer examples to aid in understanding.ONLY If the transcription is unclear or seems misspelled, spell it back to the user and ask for confirmation before moving on.NEVER include external links, promotional messages, or teaching tips.
-Once all these fields are collected, read back the entire collected information to the user and ask them to confirm it and mention that it may take a few seconds to process all the information.
-After they confirm, ask for initials and/or draw signature after conversation if missing. Then respond with 'END OF CONVERSATION' and nothing else.
+def build_dialogue_messages(state):
+    return dialogue_context.build(state.form_data, state.conversation_history)
 
-DO NOT REPEAT THE SUMMARY. DO NOT REPEAT END OF CONVERSATION.
-"""
-    try:
-        messages = [{"role": "system", "content": instruction_prompt}] + [
-            {"role": msg["role"], "content": msg["text"]} for msg in conversation_history[-12:]
-        ]
-        response = client.chat.completions.create(
+def record_assistant_reply(state, assistant_reply):
+    if state.summary_given and ("summary" in assistant_reply.lower() or "end of conversation" in assistant_reply.lower()):
+        return ""
+    return add_assistant_turn(state, assistant_reply)
+
+async def generate_dialogue_reply(messages):
+    with timed("generate"):
+        response = await chat_completion(
             model="gpt-4o",
             messages=messages,
             temperature=0.4
         )
-        assistant_reply = response.choices[0].message.content.strip()
+    return response.choices[0].message.content.strip()
+
+async def _sequential_turn(state, user_text):
+    fixed_reply = await handle_user_turn(state, user_text)
+    if fixed_reply is not None:
+        return fixed_reply
+    return record_assistant_reply(state, await generate_dialogue_reply(build_dialogue_messages(state)))
+
+QUESTION_SENTENCE = re.compile(r"[^.!?]*\?")
 
-        if summary_given and ("summary" in assistant_reply.lower() or "end of conversation" in assistant_reply.lower()):
-            return ""
+def asks_for_filled_field(reply, fields):
+    # A reply generated before extraction finished may ask for a field it just filled.
+    # Only its questions count: "thanks for the business email" is fine as it is.
+    questions = " ".join(QUESTION_SENTENCE.findall(reply)).lower()
+    return any(FIELD_LABELS[field].lower() in questions for field in fields)
+
+async def _speculative_turn(state, user_text):
+    # Starts the gpt-4o reply alongside extraction, from the form state before this
+    # turn. If extraction turns this into a fixed-reply turn the speculative reply is
+    # cancelled; if it asks about a field extraction just filled, it is regenerated.
+    fixed_reply = begin_user_turn(state, user_text)
+    if fixed_reply is not None:
+        return fixed_reply
+
+    empty_before = [field for field, value in state.form_data.items() if value is None]
+    dialogue = asyncio.create_task(generate_dialogue_reply(build_dialogue_messages(state)))
+    extracted_json = await extract_fields(state, user_text)
+    fixed_reply = finish_user_turn(state, user_text, extracted_json)
+    if fixed_reply is not None:
+        dialogue.cancel()
+        return fixed_reply
+
+    reply = await dialogue
+    newly_filled = [field for field in empty_before if state.form_data[field] is not None]
+    if asks_for_filled_field(reply, newly_filled):
+        reply = await generate_dialogue_reply(build_dialogue_messages(state))
+    return record_assistant_reply(state, reply)
+
+MERGED_INSTRUCTIONS = """
+Also extract any form fields the user's latest reply provides, using these exact field names:
+
+{fields}
+
+Respond with only a JSON object of the form
+{{"fields": {{"SiteCompanyName1": {{"value": "Jane’s Burgers", "confidence": 0.6}}}}, "reply": "<your next message to the user>"}}
+Use an empty object for "fields" if nothing applies.
+"""
 
-        last_assistant_msg = assistant_reply
-        conversation_history.append({"role": "assistant", "text": assistant_reply, "timestamp": datetime.now().isoformat()})
-        return assistant_reply
+async def _merged_turn(state, user_text):
+    # One gpt-4o call returns both the extracted fields and the next message.
+    fixed_reply = begin_user_turn(state, user_text)
+    if fixed_reply is not None:
+        return fixed_reply
 
+    messages = build_dialogue_messages(state)
+    messages.append({"role": "system", "content": MERGED_INSTRUCTIONS.format(fields=list(FORM_FIELDS))})
+    with timed("merged"):
+        response = await chat_completion(
+            model="gpt-4o",
+            messages=messages,
+            temperature=0.4,
+            response_format={"type": "json_object"}
+        )
+    merged = json.loads(response.choices[0].message.content)
+    local = fast_extract(state.last_assistant_msg, user_text)
+    fixed_reply = finish_user_turn(state, user_text, merge_extractions(merged.get("fields") or {}, local.fields))
+    if fixed_reply is not None:
+        return fixed_reply
+    return record_assistant_reply(state, str(merged.get("reply", "")).strip())
+
+def next_field_question(field):
+    return NEXT_FIELD_TEMPLATE.format(label=FIELD_LABELS[field])
+
+def _rule_parseable(field):
+    targets, complete = asked_fields(next_field_question(field))
+    return complete and [target for target, _ in targets] == [field]
+
+# Fields whose templated question the rule-based extractors can answer on their own.
+RULE_PARSEABLE_FIELDS = frozenset(field for field in FORM_FIELDS if _rule_parseable(field))
+
+def degraded_reply(state):
+    fallbacks.inc("degraded_reply")
+    if state.summary_given:
+        return add_assistant_turn(state, FALLBACK_REPLY)
+    missing = [field for field, value in state.form_data.items()
+               if value is None and field not in SIGNATURE_FIELDS]
+    if not missing:
+        state.summary_given = True
+        return add_assistant_turn(state, SIGNATURE_PROMPT)
+    # Without gpt-4 only the rules can fill an answer, so their fields go first; then
+    # the rest in turn, never the question just asked, so the form keeps moving.
+    candidates = [field for field in missing if field in RULE_PARSEABLE_FIELDS] or missing
+    asked = [field for field in candidates if next_field_question(field) == state.last_assistant_msg]
+    if asked and len(candidates) > 1:
+        i = candidates.index(asked[0])
+        candidates = candidates[i + 1:] + candidates[:i]
+    return add_assistant_turn(state, next_field_question(candidates[0]))
+
+TURN_MODES = {
+    "sequential": _sequential_turn,
+    "speculative": _speculative_turn,
+    "merged": _merged_turn,
+}
+
+async def process_transcribed_text(state, user_text, mode=None):
+    turn = TURN_MODES[mode or TURN_MODE]
+    try:
+        return await turn(state, user_text)
     except Exception as e:
         print("❌ Assistant generation error:", e)
-        return "Sorry, could you please repeat that?"
-
-def reset_assistant_state():
-    global conversation_history, last_assistant_msg, end_triggered, summary_given, summary_confirmed, pending_confirmation
-    conversation_history.clear()
-    last_assistant_msg = ""
-    end_triggered = False
-    summary_given = False
-    summary_confirmed = False
-    pending_confirmation = None
-    for key in form_data:
-        form_data[key] = None
+        return degraded_reply(state)
+
+async def dialogue_deltas(messages):
+    with timed("generate_open"):
+        stream = await chat_completion(
+            model="gpt-4o",
+            messages=messages,
+            temperature=0.4,
+            stream=True
+        )
+    async for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            yield delta
+
+async def _buffer_deltas(deltas, buffer):
+    # Runs the stream in the background; buffer gets each delta, then None at the end
+    # (or the exception that stopped it).
+    try:
+        async for delta in deltas:
+            await buffer.put(delta)
+        await buffer.put(None)
+    except Exception as e:
+        await buffer.put(e)
+
+async def _buffered_deltas(buffer):
+    while True:
+        item = await buffer.get()
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+async def stream_transcribed_text(state, user_text, mode=None):
+    # Same turn as process_transcribed_text, but yields the gpt-4o reply as it is generated.
+    mode = mode or TURN_MODE
+    if mode == "merged":
+        # The merged call answers in JSON, so there is nothing to stream before it ends.
+        reply = await process_transcribed_text(state, user_text, mode)
+        if reply:
+            yield reply
+        return
+
+    fixed_reply = begin_user_turn(state, user_text)
+    if fixed_reply is not None:
+        yield fixed_reply
+        return
+
+    empty_before = [field for field, value in state.form_data.items() if value is None]
+    speculative = None
+    if mode == "speculative":
+        # The reply streams in alongside extraction and is held back until
+        # finish_user_turn decides whether the turn gets a model reply at all.
+        buffer = asyncio.Queue()
+        speculative = asyncio.create_task(_buffer_deltas(dialogue_deltas(build_dialogue_messages(state)), buffer))
+    try:
+        extracted_json = await extract_fields(state, user_text)
+        fixed_reply = finish_user_turn(state, user_text, extracted_json)
+        if fixed_reply is not None:
+            yield fixed_reply
+            return
+
+        newly_filled = [field for field in empty_before if state.form_data[field] is not None]
+        if speculative is not None:
+            deltas = _buffered_deltas(buffer)
+        else:
+            deltas = dialogue_deltas(build_dialogue_messages(state))
+
+        if state.summary_given or (speculative is not None and newly_filled):
+            # After the summary the reply may still be suppressed, and a speculative reply
+            # may ask for a field this turn filled, so either is only sent once complete.
+            try:
+                reply = "".join([delta async for delta in deltas])
+                if speculative is not None and asks_for_filled_field(reply, newly_filled):
+                    reply = await generate_dialogue_reply(build_dialogue_messages(state))
+                reply = record_assistant_reply(state, reply.strip())
+            except Exception as e:
+                print("❌ Assistant generation error:", e)
+                reply = degraded_reply(state)
+            if reply:
+                yield reply
+            return
+
+        parts = []
+        try:
+            async for delta in deltas:
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            print("❌ Assistant generation error:", e)
+            if not parts:
+                yield degraded_reply(state)
+                return
+            fallbacks.inc("truncated_reply")
+        record_assistant_reply(state, "".join(parts).strip())
+    finally:
+        if speculative is not None:
+            speculative.cancel()
+
+_FIXED_UTTERANCES = frozenset(fixed_utterances())
+
+def reset_assistant_state(state):
+    state.reset()
@@ -0,0 +1,147 @@
+import re
+import json
+import base64
+import asyncio
+from providers import synthesize, synthesize_stream, cached_audio, audio_key
+from realtime_assistant import stream_transcribed_text
+from metrics import fallbacks
+from session_journal import share_audio
+
+# A sentence ends at terminal punctuation (plus any closing quotes/brackets) followed by whitespace.
+SENTENCE_END = re.compile(r"""[.!?…]+["'”’)\]]*\s+""")
+MIN_SENTENCE_CHARS = 12
+TTS_LOOKAHEAD = 3
+
+
+async def split_sentences(text_deltas):
+    buffer = ""
+    async for delta in text_deltas:
+        buffer += delta
+        start = 0
+        for match in SENTENCE_END.finditer(buffer):
+            if match.end() - start >= MIN_SENTENCE_CHARS:
+                yield buffer[start:match.end()].strip()
+                start = match.end()
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _speak(sentence, chunks):
+    try:
+        audio = cached_audio(sentence)
+        if audio is not None:
+            await chunks.put(audio)
+            return
+        async for chunk in synthesize_stream(sentence):
+            await chunks.put(chunk)
+    except Exception as e:
+        print("🎧 ElevenLabs speech error:", e)
+        fallbacks.inc("text_only_reply")
+    finally:
+        await chunks.put(None)
+
+
+async def _speak_to_cache(sentence, chunks):
+    # For audio_urls mode: synthesize into the TTS cache and hand back only the key.
+    try:
+        key = audio_key(sentence)
+        await share_audio(key, await synthesize(sentence))
+        await chunks.put(key)
+    except Exception as e:
+        print("🎧 ElevenLabs speech error:", e)
+        fallbacks.inc("text_only_reply")
+    finally:
+        await chunks.put(None)
+
+
+async def stream_reply_events(state, user_text, audio_urls=False, form_version=None, compact=False,
+                              reply_deltas=None):
+    # Yields SSE events: the assistant text as it is generated, then per-sentence audio
+    # chunks. TTS for a sentence starts as soon as the sentence is complete, so the first
+    # sentence can play while later ones are still being generated.
+    # With audio_urls, audio is not inlined: each audio_end carries an /audio/{key} URL
+    # to fetch as raw bytes. With form_version (or compact), done carries the form
+    # version and only the fields changed since form_version instead of the whole form.
+    # reply_deltas replaces the assistant turn with a given text source.
+    events = asyncio.Queue()
+    sentences = asyncio.Queue(maxsize=TTS_LOOKAHEAD)
+    text_parts = []
+
+    async def text_deltas():
+        source = reply_deltas if reply_deltas is not None else stream_transcribed_text(state, user_text)
+        async for delta in source:
+            text_parts.append(delta)
+            await events.put(sse_event("assistant_text", {"delta": delta}))
+            yield delta
+
+    async def generate():
+        try:
+            async for sentence in split_sentences(text_deltas()):
+                chunks = asyncio.Queue()
+                speak = _speak_to_cache if audio_urls else _speak
+                task = asyncio.create_task(speak(sentence, chunks))
+                await sentences.put((sentence, chunks, task))
+        finally:
+            await sentences.put(None)
+
+    async def play():
+        seq = 0
+        while True:
+            item = await sentences.get()
+            if item is None:
+                break
+            sentence, chunks, task = item
+            end = {"seq": seq, "text": sentence}
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                if audio_urls:
+                    end["audio_url"] = f"/audio/{chunk}"
+                    continue
+                await events.put(sse_event("audio", {
+                    "seq": seq,
+                    "audio_base64": base64.b64encode(chunk).decode("utf-8")
+                }))
+            await task
+            await events.put(sse_event("audio_end", end))
+            seq += 1
+
+    async def run():
+        try:
+            await asyncio.gather(generate(), play())
+        except Exception as e:
+            print("❌ Error in streamed reply:", e)
+            await events.put(sse_event("error", {"error": str(e)}))
+        finally:
+            await events.put(None)
+
+    form_before = dict(state.form_data)
+    committed = False
+    runner = asyncio.create_task(run())
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        state.commit_form_changes(form_before)
+        committed = True
+        done = {"assistant_text": "".join(text_parts).strip()}
+        if form_version is None and not compact:
+            done["form_data"] = state.form_data
+        else:
+            done.update(state.form_delta(form_version))
+        yield sse_event("done", done)
+    finally:
+        if not runner.done():
+            runner.cancel()
+        if not committed:
+            # The client left mid-reply: fields extracted so far still get their version,
+            # or the next turn's form_before would already hold them and no delta sends them.
+            state.commit_form_changes(form_before)
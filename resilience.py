@@ -0,0 +1,159 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque, defaultdict
+from metrics import provider_retries, provider_hedges, circuit_opens
+
+# Retry, hedging and circuit-breaker policy for provider calls. Every call runs under
+# one deadline (the stage timeout); retries and hedges only spend what is left of it.
+MAX_ATTEMPTS = int(os.getenv("PROVIDER_MAX_ATTEMPTS", "3"))
+RETRY_BACKOFF_SECONDS = float(os.getenv("PROVIDER_RETRY_BACKOFF_SECONDS", "0.2"))
+# An attempt is not started unless at least this much of the deadline remains.
+MIN_ATTEMPT_SECONDS = 0.5
+HEDGE_STAGES = frozenset(filter(None, os.getenv("PROVIDER_HEDGE_STAGES", "stt,llm,tts").split(",")))
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+BREAKER_FAILURES = int(os.getenv("PROVIDER_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("PROVIDER_BREAKER_RESET_SECONDS", "15"))
+
+RETRYABLE_STATUS = frozenset((408, 409, 425, 429))
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, stage):
+        super().__init__(f"{stage} provider circuit is open")
+        self.stage = stage
+
+
+def is_retryable(error):
+    # Only reached after a provider call, so httpx is already loaded.
+    import httpx
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    # openai.APIConnectionError wraps transport errors without a status code.
+    if type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in RETRYABLE_STATUS or status >= 500)
+
+
+class LatencyWindow:
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class CircuitBreaker:
+    # closed -> open after `failures` failed calls in a row; open rejects calls until
+    # `reset_seconds` pass, then half-open lets calls through: the next success closes
+    # it again, the next failure reopens it.
+    def __init__(self, stage, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.stage = stage
+        self.failure_threshold = failures
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self.state = "half_open"
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                circuit_opens.inc(self.stage)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class StageGuard:
+    def __init__(self, stage, timeout, max_attempts=MAX_ATTEMPTS, hedge=None):
+        self.stage = stage
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.hedge = stage in HEDGE_STAGES if hedge is None else hedge
+        self.breaker = CircuitBreaker(stage)
+        # One window per kind of call (model, streamed or not), so a slow kind does not
+        # set the hedge delay of a fast one.
+        self.latencies = defaultdict(LatencyWindow)
+
+    def hedge_delay(self, kind=None):
+        if not self.hedge:
+            return None
+        threshold = self.latencies[kind].percentile(HEDGE_PERCENTILE)
+        return None if threshold is None else max(threshold, HEDGE_MIN_DELAY)
+
+    async def call(self, make_call, hedge=True, kind=None):
+        # make_call returns a fresh coroutine for each attempt or hedge.
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.stage)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        attempt = 0
+        while True:
+            attempt += 1
+            started = loop.time()
+            try:
+                attempt_call = self._hedged(make_call, kind) if hedge else make_call()
+                result = await asyncio.wait_for(attempt_call, deadline - started)
+            except Exception as e:
+                backoff = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                remaining = deadline - loop.time()
+                retryable = is_retryable(e)
+                if attempt >= self.max_attempts or not retryable or remaining < backoff + MIN_ATTEMPT_SECONDS:
+                    # A client error (a bad request, say) means the provider answered, so
+                    # only timeouts, transport errors and retryable statuses count against it.
+                    if retryable:
+                        self.breaker.record_failure()
+                    raise
+                provider_retries.inc(self.stage)
+                print(f"🔁 Retrying {self.stage} after {type(e).__name__}: {e}")
+                await asyncio.sleep(backoff)
+                continue
+            self.latencies[kind].add(loop.time() - started)
+            self.breaker.record_success()
+            return result
+
+    async def _hedged(self, make_call, kind):
+        # Sends a duplicate request once the first has run longer than the recent p95;
+        # whichever succeeds first wins and the other is cancelled.
+        delay = self.hedge_delay(kind)
+        if delay is None:
+            return await make_call()
+        pending = {asyncio.ensure_future(make_call())}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                provider_hedges.inc(self.stage)
+                pending.add(asyncio.ensure_future(make_call()))
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
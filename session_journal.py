@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Durable session state shared by every worker on one host. Each request that changes
+# a session appends one journal entry; any worker rebuilds the session from its latest
+# snapshot plus the entries after it. SQLite's WAL mode relies on shared memory, so the
+# file must sit on a local disk: replicas on separate hosts need a different store.
+SESSION_JOURNAL_PATH = os.getenv("SESSION_JOURNAL_PATH", "sessions.db")
+SNAPSHOT_EVERY = int(os.getenv("SESSION_SNAPSHOT_EVERY", "20"))
+SESSION_JOURNAL_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+# Turn audio is only fetched right after it is announced, so it is kept briefly.
+AUDIO_TTL_SECONDS = 600
+PRUNE_EVERY = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    snapshot TEXT,
+    snapshot_seq INTEGER NOT NULL DEFAULT 0,
+    last_seq INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS journal (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS audio (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+class SessionJournal:
+    # All SQLite work happens on one dedicated thread, which owns the connection, so
+    # the event loop never waits on disk.
+    def __init__(self, path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="session-journal")
+        self._db = None
+        self._writes = 0
+
+    def _connect(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _read(self, session_id, after_seq):
+        # Returns (snapshot or None, entries after it, last_seq), or None when nothing is newer.
+        db = self._connect()
+        # One read transaction, so the entries and last_seq come from the same commit.
+        db.execute("BEGIN")
+        try:
+            return self._read_since(db, session_id, after_seq)
+        finally:
+            db.execute("COMMIT")
+
+    def _read_since(self, db, session_id, after_seq):
+        row = db.execute(
+            "SELECT snapshot, snapshot_seq, last_seq FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or row[2] <= after_seq:
+            return None
+        snapshot, snapshot_seq, last_seq = row
+        if snapshot is not None and after_seq < snapshot_seq:
+            after_seq = snapshot_seq
+        else:
+            snapshot = None
+        entries = [json.loads(entry) for (entry,) in db.execute(
+            "SELECT entry FROM journal WHERE session_id = ? AND seq > ? AND seq <= ? ORDER BY seq",
+            (session_id, after_seq, last_seq)
+        )]
+        return (json.loads(snapshot) if snapshot else None), entries, last_seq
+
+    def _append(self, session_id, expected_seq, entry, snapshot):
+        # Appends entry right after expected_seq. If another worker appended since then,
+        # nothing is written and the entries this worker missed are returned instead, as
+        # (None, (snapshot or None, entries, last_seq)); otherwise (seq, None).
+        db = self._connect()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT snapshot_seq, last_seq FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            snapshot_seq, last_seq = row if row else (0, 0)
+            if last_seq > expected_seq:
+                missed = self._read_since(db, session_id, expected_seq)
+                db.execute("ROLLBACK")
+                return None, missed
+            seq = expected_seq + 1
+            db.execute("INSERT OR REPLACE INTO journal (session_id, seq, entry) VALUES (?, ?, ?)",
+                       (session_id, seq, json.dumps(entry)))
+            # A journal behind this worker (pruned, or a new file) can't rebuild the
+            # session from entries alone, so it gets a snapshot too.
+            if seq - snapshot_seq >= SNAPSHOT_EVERY or last_seq < expected_seq:
+                # Fold the journal into a snapshot so replay stays short.
+                db.execute(
+                    "INSERT INTO sessions (session_id, snapshot, snapshot_seq, last_seq, updated) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (session_id) DO UPDATE SET snapshot = excluded.snapshot, "
+                    "snapshot_seq = excluded.snapshot_seq, last_seq = excluded.last_seq, updated = excluded.updated",
+                    (session_id, json.dumps(snapshot), seq, seq, now))
+                db.execute("DELETE FROM journal WHERE session_id = ? AND seq <= ?", (session_id, seq))
+            else:
+                db.execute(
+                    "INSERT INTO sessions (session_id, last_seq, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT (session_id) DO UPDATE SET last_seq = excluded.last_seq, updated = excluded.updated",
+                    (session_id, seq, now))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self._prune(now)
+        return seq, None
+
+    def _prune(self, now):
+        db = self._connect()
+        cutoff = now - SESSION_JOURNAL_TTL_SECONDS
+        db.execute("DELETE FROM journal WHERE session_id IN (SELECT session_id FROM sessions WHERE updated < ?)",
+                   (cutoff,))
+        db.execute("DELETE FROM sessions WHERE updated < ?", (cutoff,))
+        db.execute("DELETE FROM audio WHERE created < ?", (now - AUDIO_TTL_SECONDS,))
+
+    def _put_audio(self, key, audio):
+        self._connect().execute("INSERT OR IGNORE INTO audio (key, data, created) VALUES (?, ?, ?)",
+                                (key, audio, time.time()))
+
+    def _get_audio(self, key):
+        row = self._connect().execute("SELECT data FROM audio WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    async def refresh(self, state):
+        # Brings an in-memory session up to date with whatever other workers appended.
+        async with state.journal_lock:
+            return await self._refresh(state)
+
+    async def _refresh(self, state):
+        update = await self._run(self._read, state.session_id, state.journal_seq)
+        if update is None:
+            return state
+        snapshot, entries, last_seq = update
+        if snapshot is not None:
+            state.restore_snapshot(snapshot)
+        for entry in entries:
+            state.apply_entry(entry)
+        state.journal_seq = last_seq
+        state.mark_persisted()
+        return state
+
+    async def save(self, state):
+        async with state.journal_lock:
+            await self._save(state)
+
+    async def _save(self, state):
+        entry = state.journal_entry()
+        if entry is None:
+            return
+        while True:
+            state.mark_persisted()
+            # The snapshot is a shallow copy taken here, on the loop; it is only serialized
+            # when one is due.
+            seq, missed = await self._run(
+                self._append, state.session_id, state.journal_seq, entry, state.to_snapshot())
+            if missed is None:
+                state.journal_seq = seq
+                return
+            # Another worker appended since this one last synced: replay its entries
+            # first, then this worker's entry on top (the later write wins) and retry
+            # after them, so journal_seq only ever moves over entries applied here.
+            later = state.journal_entry()
+            if later is not None:
+                entry = merge_entries(entry, later)
+            snapshot, entries, last_seq = missed
+            state.rebase(snapshot, entries, entry)
+            state.journal_seq = last_seq
+
+    async def put_audio(self, key, audio):
+        await self._run(self._put_audio, key, audio)
+
+    async def get_audio(self, key):
+        return await self._run(self._get_audio, key)
+
+    def close(self):
+        def close_db():
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        self._executor.submit(close_db).result()
+        self._executor.shutdown()
+
+
+def merge_entries(first, second):
+    # One entry with the effect of applying first, then second.
+    if second.get("reset"):
+        return second
+    merged = dict(first)
+    for key in ("form", "field_versions", "fields"):
+        if key in second:
+            merged[key] = {**first.get(key, {}), **second[key]}
+    if "turns" in second:
+        merged["turns"] = first.get("turns", []) + second["turns"]
+    return merged
+
+
+journal = SessionJournal(SESSION_JOURNAL_PATH) if SESSION_JOURNAL_PATH else None
+
+
+def close():
+    if journal is not None:
+        journal.close()
+
+
+async def share_audio(key, audio):
+    # Lets another worker answer GET /audio/{key} for audio synthesized here.
+    if journal is not None:
+        await journal.put_audio(key, audio)
+
+
+async def shared_audio(key):
+    return await journal.get_audio(key) if journal is not None else None
@@ -0,0 +1,291 @@
+import os
+import time
+import uuid
+import base64
+import asyncio
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from session_journal import journal
+
+FORM_FIELDS = (
+    "SiteCompanyName1", "SiteAddress", "SiteCity", "SiteState", "SiteZip",
+    "SiteVoice", "SiteFax", "CorporateCompanyName1", "CorporateAddress",
+    "CorporateCity", "CorporateState", "CorporateZip", "CorporateName",
+    "SiteEmail", "CorporateVoice", "CorporateFax", "BusinessWebsite",
+    "CorporateEmail", "CustomerSvcEmail", "AppRetrievalMail", "AppRetrievalFax",
+    "AppRetrievalFaxNumber", "MCC-Desc",
+
+    # Simplified: use one initials and one signature field
+    "MerchantInitials",
+    "MerchantSignatureName",
+)
+
+SESSION_COOKIE = "session_id"
+SESSION_HEADER = "x-session-id"
+
+# Only the most recent turns are kept; prompts are built from the form state plus a short window.
+HISTORY_LIMIT = int(os.getenv("SESSION_HISTORY_LIMIT", "40"))
+
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "5000"))
+
+
+class SessionState:
+    __slots__ = (
+        "session_id", "form_data", "conversation_history", "last_assistant_msg",
+        "end_triggered", "summary_given", "summary_confirmed", "pending_confirmation",
+        "signature_png", "artifact_key", "artifact_inputs", "form_version",
+        "field_versions", "reset_version", "last_seen", "turn_count", "journal_seq", "persisted",
+        "journal_lock",
+    )
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.form_data = dict.fromkeys(FORM_FIELDS)
+        self.conversation_history = []
+        self.last_assistant_msg = ""
+        self.end_triggered = False
+        self.summary_given = False
+        self.summary_confirmed = False
+        self.pending_confirmation = None
+        # Normalized 1-bit PNG, ready to embed in the PDF.
+        self.signature_png = None
+        # Key of the last confirmed PDF and the (data, signature) it was rendered from,
+        # so it can be rendered again if the artifact store evicted it.
+        self.artifact_key = None
+        self.artifact_inputs = None
+        # form_version counts changes to form_data; field_versions holds the version at
+        # which each field last changed, so clients can ask for just what is newer.
+        self.form_version = 0
+        self.field_versions = {}
+        self.reset_version = 0
+        self.last_seen = time.monotonic()
+        # turn_count keeps counting past HISTORY_LIMIT, so the journal knows which turns are new.
+        self.turn_count = 0
+        self.journal_seq = 0
+        self.persisted = self._journal_baseline()
+        # Saves and refreshes of one session run one at a time: each reads journal_seq
+        # and the persisted baseline, and only moves them on once the journal answered.
+        self.journal_lock = asyncio.Lock()
+
+    def append_turn(self, role, text):
+        self.conversation_history.append({
+            "role": role,
+            "text": text,
+            "timestamp": datetime.now().isoformat()
+        })
+        self.turn_count += 1
+        if len(self.conversation_history) > HISTORY_LIMIT:
+            del self.conversation_history[:-HISTORY_LIMIT]
+
+    def reset(self):
+        self.conversation_history.clear()
+        self.last_assistant_msg = ""
+        self.end_triggered = False
+        self.summary_given = False
+        self.summary_confirmed = False
+        self.pending_confirmation = None
+        self.signature_png = None
+        self.artifact_key = None
+        self.artifact_inputs = None
+        for key in self.form_data:
+            self.form_data[key] = None
+        self.form_version += 1
+        self.field_versions.clear()
+        self.reset_version = self.form_version
+
+    def commit_form_changes(self, before):
+        # before is a copy of form_data taken at the start of the turn.
+        changed = [key for key, value in self.form_data.items() if before.get(key) != value]
+        if changed:
+            self.form_version += 1
+            for key in changed:
+                self.field_versions[key] = self.form_version
+        return changed
+
+    def form_delta(self, since):
+        # Fields changed after version `since`. A client that is behind the last reset
+        # (or ahead of this server) gets the whole form instead.
+        if since is None or since < self.reset_version or since > self.form_version:
+            return {"form_version": self.form_version, "form_full": True, "form_delta": dict(self.form_data)}
+        delta = {key: self.form_data[key] for key, version in self.field_versions.items() if version > since}
+        return {"form_version": self.form_version, "form_full": False, "form_delta": delta}
+
+    def _journal_fields(self):
+        pending = self.pending_confirmation
+        inputs = self.artifact_inputs
+        return {
+            "last_assistant_msg": self.last_assistant_msg,
+            "end_triggered": self.end_triggered,
+            "summary_given": self.summary_given,
+            "summary_confirmed": self.summary_confirmed,
+            "pending_confirmation": list(pending) if pending else None,
+            "signature_png": _encode_bytes(self.signature_png),
+            "artifact_key": self.artifact_key,
+            "artifact_inputs": [inputs[0], _encode_bytes(inputs[1])] if inputs else None,
+            "form_version": self.form_version,
+            "reset_version": self.reset_version,
+        }
+
+    def _restore_fields(self, fields):
+        for name, value in fields.items():
+            if name == "pending_confirmation" and value is not None:
+                value = tuple(value)
+            elif name == "signature_png":
+                value = _decode_bytes(value)
+            elif name == "artifact_inputs" and value is not None:
+                value = (value[0], _decode_bytes(value[1]))
+            setattr(self, name, value)
+
+    def _journal_baseline(self):
+        return {
+            "turn_count": self.turn_count,
+            "form_data": dict(self.form_data),
+            "field_versions": dict(self.field_versions),
+            "fields": self._journal_fields(),
+        }
+
+    def mark_persisted(self):
+        self.persisted = self._journal_baseline()
+
+    def journal_entry(self):
+        # Everything that changed since the last save or refresh, or None. Replayed in
+        # order by apply_entry: reset, form fields, turns, then the remaining state.
+        before = self.persisted
+        fields = self._journal_fields()
+        entry = {}
+        if fields["reset_version"] != before["fields"]["reset_version"]:
+            entry["reset"] = True
+        form = {key: value for key, value in self.form_data.items() if before["form_data"].get(key) != value}
+        if form:
+            entry["form"] = form
+        versions = {key: version for key, version in self.field_versions.items()
+                    if before["field_versions"].get(key) != version}
+        if versions:
+            entry["field_versions"] = versions
+        new_turns = min(self.turn_count - before["turn_count"], len(self.conversation_history))
+        if new_turns > 0:
+            entry["turns"] = self.conversation_history[-new_turns:]
+        changed = {name: value for name, value in fields.items() if before["fields"][name] != value}
+        if changed:
+            entry["fields"] = changed
+        return entry or None
+
+    def apply_entry(self, entry):
+        if entry.get("reset"):
+            self.reset()
+        self.form_data.update(entry.get("form", {}))
+        self.field_versions.update(entry.get("field_versions", {}))
+        for turn in entry.get("turns", ()):
+            self.conversation_history.append(turn)
+            self.turn_count += 1
+        if len(self.conversation_history) > HISTORY_LIMIT:
+            del self.conversation_history[:-HISTORY_LIMIT]
+        self._restore_fields(entry.get("fields", {}))
+
+    def rebase(self, snapshot, entries, entry):
+        # entry is this worker's unsaved change, already applied here. The journal has
+        # moved on underneath it, so its turns are taken back out, the missed snapshot
+        # and entries replayed, and entry applied again on top.
+        turns = len(entry.get("turns", ()))
+        if turns:
+            del self.conversation_history[-turns:]
+            self.turn_count -= turns
+        if snapshot is not None:
+            self.restore_snapshot(snapshot)
+        for missed in entries:
+            self.apply_entry(missed)
+        self.apply_entry(entry)
+
+    def to_snapshot(self):
+        return {
+            "form_data": dict(self.form_data),
+            "field_versions": dict(self.field_versions),
+            "history": list(self.conversation_history),
+            "turn_count": self.turn_count,
+            "fields": self._journal_fields(),
+        }
+
+    def restore_snapshot(self, snapshot):
+        self.form_data = dict.fromkeys(FORM_FIELDS)
+        self.form_data.update(snapshot["form_data"])
+        self.field_versions = dict(snapshot["field_versions"])
+        self.conversation_history = list(snapshot["history"])
+        self.turn_count = snapshot["turn_count"]
+        self._restore_fields(snapshot["fields"])
+
+
+def _encode_bytes(data):
+    return base64.b64encode(data).decode("ascii") if data else None
+
+
+def _decode_bytes(text):
+    return base64.b64decode(text) if text else None
+
+
+class SessionStore:
+    # LRU ordered: the most recently used session sits at the end.
+    def __init__(self, ttl_seconds=SESSION_TTL_SECONDS, max_entries=SESSION_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = SessionState(session_id)
+                self._sessions[session_id] = state
+            else:
+                self._sessions.move_to_end(session_id)
+            state.last_seen = now
+            self._evict(now)
+        return state
+
+    async def load(self, session_id):
+        # Another worker may have advanced this session since we last saw it.
+        state = self.get(session_id)
+        if journal is not None:
+            await journal.refresh(state)
+        return state
+
+    async def save(self, state):
+        if journal is not None:
+            await journal.save(state)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict(self, now):
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+        cutoff = now - self.ttl_seconds
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_seen >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def session_id_from_request(request):
+    session_id = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+    if session_id and len(session_id) <= 64 and session_id.isalnum():
+        return session_id
+    return None
+
+
+sessions = SessionStore()
@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from audio_ingest import ingest_audio
+from providers import transcribe
+from metrics import timed, fallbacks
+
+# Incremental uploads: the browser closes a segment (a complete recording) at each
+# short pause and uploads it in timeslices while the user is still talking. A closed
+# segment is transcribed in the background, so when speech ends only the last one is
+# left to wait for. Utterances live in this worker's memory; a worker that has not
+# seen every chunk answers 409 and the client re-sends the segments in one upload.
+MAX_UTTERANCE_BYTES = int(os.getenv("MAX_UTTERANCE_BYTES", str(8 * 1024 * 1024)))
+# All utterances in this worker together; past it new chunks are refused until turns finish.
+MAX_BUFFERED_BYTES = int(os.getenv("MAX_BUFFERED_UTTERANCE_BYTES", str(64 * 1024 * 1024)))
+MAX_UTTERANCE_SEGMENTS = 32
+UTTERANCE_TTL_SECONDS = 120
+MAX_UTTERANCES = 1000
+# Every chunk of an utterance has to reach the same worker. With several workers and no
+# sticky routing most turns would end in a 409 and a full re-upload, so by default
+# ("auto") incremental uploads are only offered when there is a single worker.
+INCREMENTAL_UPLOADS = os.getenv("INCREMENTAL_UPLOADS", "auto")
+if INCREMENTAL_UPLOADS == "auto":
+    INCREMENTAL_UPLOADS = int(os.getenv("WEB_CONCURRENCY", "1")) <= 1
+else:
+    INCREMENTAL_UPLOADS = INCREMENTAL_UPLOADS.lower() in ("1", "true", "yes")
+
+
+class IncompleteUtterance(Exception):
+    pass
+
+
+class BufferFull(Exception):
+    pass
+
+
+async def transcribe_recording(contents, filename="recording.webm"):
+    # Returns None when STT is unavailable, so the turn can ask the caller to repeat.
+    with timed("ingest"):
+        ingest = await asyncio.to_thread(ingest_audio, contents, filename)
+    if ingest.original_seconds is None:
+        fallbacks.inc("original_audio")
+    print(
+        f"🎚️ Ingest: {ingest.original_bytes} -> {len(ingest.data)} bytes "
+        f"(saved {ingest.bytes_saved} bytes, {ingest.seconds_saved:.2f}s of silence)"
+    )
+    try:
+        user_text = await transcribe(ingest.as_file())
+    except Exception as e:
+        print("⚠️ Transcription unavailable:", e)
+        fallbacks.inc("stt_unavailable")
+        return None
+    print(f"🎤 USER SAID: {user_text}")
+    return user_text
+
+
+def stitch(texts):
+    # Segment transcripts in order; None only if no segment could be transcribed.
+    if texts and all(text is None for text in texts):
+        return None
+    return " ".join(text.strip() for text in texts if text and text.strip())
+
+
+async def transcribe_segments(recordings):
+    # recordings: (contents, filename) pairs, transcribed concurrently.
+    return stitch(await asyncio.gather(*(transcribe_recording(*recording) for recording in recordings)))
+
+
+class Utterance:
+    __slots__ = ("chunks", "chunk_counts", "tasks", "size", "last_seen")
+
+    def __init__(self):
+        self.chunks = {}        # segment -> {seq: bytes}, until the segment is complete
+        self.chunk_counts = {}  # segment -> number of chunks, once its last chunk arrived
+        self.tasks = {}         # segment -> background transcription
+        self.size = 0
+        self.last_seen = time.monotonic()
+
+    def cancel(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+
+class UtteranceStore:
+    def __init__(self, max_bytes=MAX_UTTERANCE_BYTES, ttl_seconds=UTTERANCE_TTL_SECONDS,
+                 max_buffered_bytes=MAX_BUFFERED_BYTES):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_buffered_bytes = max_buffered_bytes
+        self.buffered_bytes = 0
+        self._utterances = OrderedDict()
+
+    def __len__(self):
+        return len(self._utterances)
+
+    def check_size(self, key, size):
+        # Raises before a chunk of `size` bytes is read: OverflowError when it would take
+        # its utterance past max_bytes, BufferFull when this worker has no room for it.
+        utterance = self._utterances.get(key)
+        if size + (utterance.size if utterance is not None else 0) > self.max_bytes:
+            self.discard(key)
+            raise OverflowError("utterance too large")
+        self._evict(time.monotonic())
+        if self.buffered_bytes + size > self.max_buffered_bytes:
+            self.discard(key)
+            raise BufferFull("too much audio buffered")
+
+    def add_chunk(self, key, segment, seq, data, last=False):
+        # key is (session_id, utterance_id). Chunks may arrive out of order.
+        if not 0 <= segment < MAX_UTTERANCE_SEGMENTS or seq < 0:
+            raise ValueError("chunk out of range")
+        self.check_size(key, len(data))
+        now = time.monotonic()
+        utterance = self._utterances.get(key)
+        if utterance is None:
+            utterance = self._utterances[key] = Utterance()
+        utterance.last_seen = now
+        self._utterances.move_to_end(key)
+
+        if segment in utterance.tasks:
+            raise ValueError("segment already complete")
+        utterance.size += len(data)
+        self.buffered_bytes += len(data)
+
+        utterance.chunks.setdefault(segment, {})[seq] = data
+        if last:
+            utterance.chunk_counts[segment] = seq + 1
+        count = utterance.chunk_counts.get(segment)
+        chunks = utterance.chunks[segment]
+        if count is not None and len(chunks) == count and all(i in chunks for i in range(count)):
+            contents = b"".join(chunks[i] for i in range(count))
+            del utterance.chunks[segment]
+            utterance.tasks[segment] = asyncio.create_task(
+                transcribe_recording(contents, f"segment{segment}.webm"))
+
+    async def finish(self, key, segments):
+        # Stitched transcript of segments 0..segments-1. Raises IncompleteUtterance when
+        # any of them never fully arrived here.
+        utterance = self._pop(key)
+        if utterance is None or not 0 < segments <= MAX_UTTERANCE_SEGMENTS \
+                or any(segment not in utterance.tasks for segment in range(segments)):
+            if utterance is not None:
+                utterance.cancel()
+            raise IncompleteUtterance(key[1])
+        for segment, task in utterance.tasks.items():
+            if segment >= segments:
+                task.cancel()
+        with timed("stt_wait"):
+            return stitch(await asyncio.gather(*(utterance.tasks[segment] for segment in range(segments))))
+
+    def discard(self, key):
+        utterance = self._pop(key)
+        if utterance is not None:
+            utterance.cancel()
+
+    def _pop(self, key):
+        utterance = self._utterances.pop(key, None)
+        if utterance is not None:
+            self.buffered_bytes -= utterance.size
+        return utterance
+
+    def _evict(self, now):
+        cutoff = now - self.ttl_seconds
+        while self._utterances:
+            key, oldest = next(iter(self._utterances.items()))
+            if len(self._utterances) <= MAX_UTTERANCES and oldest.last_seen >= cutoff:
+                break
+            self._pop(key).cancel()
+
+
+utterances = UtteranceStore()
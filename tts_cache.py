@@ -0,0 +1,86 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".tts_cache")
+TTS_CACHE_MAX_ENTRIES = int(os.getenv("TTS_CACHE_MAX_ENTRIES", "512"))
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+def cache_key(voice_id, model_id, text):
+    raw = "\x00".join((voice_id, model_id, normalize_text(text)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    # Two tiers: an in-memory LRU for anything synthesized recently, and a
+    # content-addressed directory for audio worth keeping across restarts.
+    def __init__(self, directory=TTS_CACHE_DIR, max_entries=TTS_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".mp3")
+
+    def _remember(self, key, audio):
+        with self._lock:
+            self._memory[key] = audio
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return audio
+        try:
+            with open(self._path(key), "rb") as f:
+                audio = f.read()
+        except OSError:
+            self.counters["misses"] += 1
+            return None
+        self.counters["disk_hits"] += 1
+        self._remember(key, audio)
+        return audio
+
+    def put(self, key, audio, persist=False):
+        self._remember(key, audio)
+        if not persist:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(audio)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print("⚠️ TTS cache write error:", e)
+
+    def contains(self, key):
+        with self._lock:
+            if key in self._memory:
+                return True
+        return os.path.exists(self._path(key))
+
+    def stats(self):
+        lookups = sum(self.counters.values())
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        return {
+            **self.counters,
+            "memory_entries": len(self._memory),
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+tts_cache = TTSCache()
@@ -0,0 +1,133 @@
+import json
+import asyncio
+from fastapi import WebSocketDisconnect
+from gpt4o_realtime_ws import open_realtime
+from realtime_assistant import INSTRUCTION_PROMPT, handle_user_turn, record_assistant_reply
+from session_store import sessions
+
+# Browser protocol for /ws/voice:
+#   browser -> server  binary frames of pcm16 mono 24 kHz microphone audio,
+#                      text frames {"type": "interrupt"} to stop playback
+#   server -> browser  binary frames of pcm16 assistant audio, and JSON frames
+#                      session / user_text / assistant_text / interrupt / form_data / end / error
+#
+# Both directions go through bounded queues: a slow upstream stops us reading from
+# the browser, and a slow browser stops us reading from the upstream.
+INBOUND_QUEUE_CHUNKS = 32
+OUTBOUND_QUEUE_FRAMES = 64
+
+
+async def relay_voice(websocket, state):
+    await websocket.accept()
+    await websocket.send_json({"type": "session", "session_id": state.session_id, "form_data": state.form_data})
+
+    inbound = asyncio.Queue(maxsize=INBOUND_QUEUE_CHUNKS)
+    outbound = asyncio.Queue(maxsize=OUTBOUND_QUEUE_FRAMES)
+    flags = {"response_active": False, "skip_transcript": False}
+    turns = set()
+
+    try:
+        async with open_realtime(INSTRUCTION_PROMPT) as upstream:
+
+            def drop_queued_audio():
+                kept = []
+                while not outbound.empty():
+                    frame = outbound.get_nowait()
+                    if not isinstance(frame, bytes):
+                        kept.append(frame)
+                for frame in kept:
+                    outbound.put_nowait(frame)
+
+            async def barge_in():
+                if flags["response_active"]:
+                    await upstream.cancel_response()
+                drop_queued_audio()
+                await outbound.put({"type": "interrupt"})
+
+            async def run_turn(user_text):
+                # Same turn logic as the HTTP loop; a fixed reply replaces whatever the
+                # model started saying on its own.
+                form_before = dict(state.form_data)
+                fixed_reply = await handle_user_turn(state, user_text)
+                state.commit_form_changes(form_before)
+                if fixed_reply is not None:
+                    await barge_in()
+                    if state.end_triggered:
+                        await outbound.put({"type": "end", "form_data": state.form_data})
+                    else:
+                        flags["skip_transcript"] = True
+                        await upstream.say(fixed_reply)
+                await outbound.put({"type": "form_data", "form_data": state.form_data,
+                                    "form_version": state.form_version})
+                await sessions.save(state)
+
+            async def from_browser():
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        return
+                    if message.get("bytes"):
+                        await inbound.put(message["bytes"])
+                    elif message.get("text"):
+                        control = json.loads(message["text"])
+                        if control.get("type") == "interrupt":
+                            await barge_in()
+
+            async def to_upstream():
+                while True:
+                    chunk = await inbound.get()
+                    await upstream.send_audio(chunk)
+
+            async def from_upstream():
+                async for event in upstream.events():
+                    kind = event["type"]
+                    if kind == "audio":
+                        await outbound.put(event["audio"])
+                    elif kind == "text":
+                        await outbound.put({"type": "assistant_text", "delta": event["text"]})
+                    elif kind == "assistant_text":
+                        if flags["skip_transcript"]:
+                            flags["skip_transcript"] = False
+                        else:
+                            record_assistant_reply(state, event["text"])
+                            await sessions.save(state)
+                    elif kind == "user_text":
+                        await outbound.put({"type": "user_text", "text": event["text"]})
+                        turn = asyncio.create_task(run_turn(event["text"]))
+                        turns.add(turn)
+                        turn.add_done_callback(turns.discard)
+                    elif kind == "speech_started":
+                        await barge_in()
+                    elif kind == "response_started":
+                        flags["response_active"] = True
+                    elif kind == "response_done":
+                        flags["response_active"] = False
+                    elif kind == "error":
+                        print("⚠️ Realtime upstream error:", event["error"])
+                        await outbound.put({"type": "error", "error": event["error"].get("message", "upstream error")})
+
+            async def to_browser():
+                while True:
+                    frame = await outbound.get()
+                    if isinstance(frame, bytes):
+                        await websocket.send_bytes(frame)
+                    else:
+                        await websocket.send_json(frame)
+
+            tasks = [asyncio.create_task(t()) for t in (from_browser, to_upstream, from_upstream, to_browser)]
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            finally:
+                for task in tasks + list(turns):
+                    task.cancel()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print("❌ Error in /ws/voice:", e)
+        try:
+            await websocket.send_json({"type": "error", "error": str(e)})
+            await websocket.close(code=1011)
+        except Exception:
+            pass